@@ -2,10 +2,16 @@ from flask import Flask, render_template, request, redirect, url_for
 import pandas as pd
 import numpy as np
 
-from src.model import PredictionModel
+from src.prediction_model import PredictionModel
 
 app = Flask(__name__)
 
+# Load the fitted artifacts once per worker rather than on every request
+model_path = "./models/lasso-reg-model.pkl"
+scalar_path = "./models/scaler.pkl"
+encoder_path = "./models/encoder.pkl"
+prediction_model = PredictionModel(model_path, scalar_path, encoder_path)
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     """Display the index page."""
@@ -28,11 +34,6 @@ def results():
         X = pd.DataFrame.from_dict(answers_d)
 
         # Transform and predict
-        model_path = "./models/lasso-reg-model.pkl"
-        scalar_path = "./models/scaler.pkl"
-        encoder_path = "./models/encoder.pkl"
-        prediction_model = PredictionModel(
-            model_path, scalar_path, encoder_path)
         X_transformed = prediction_model.transform(X)
         y_pred = prediction_model.predict(X_transformed)
 
@@ -0,0 +1,69 @@
+-- Rebuild the raw tables with keys, indexes and yearly crash_date partitions
+
+ALTER TABLE crashes_raw RENAME TO crashes_raw_unpartitioned;
+ALTER TABLE people_raw RENAME TO people_raw_unpartitioned;
+
+ALTER TABLE crashes_raw_unpartitioned
+    ALTER COLUMN crash_date TYPE TIMESTAMP USING crash_date::TIMESTAMP;
+ALTER TABLE people_raw_unpartitioned
+    ALTER COLUMN crash_date TYPE TIMESTAMP USING crash_date::TIMESTAMP;
+
+CREATE TABLE crashes_raw (LIKE crashes_raw_unpartitioned)
+    PARTITION BY RANGE (crash_date);
+ALTER TABLE crashes_raw
+    ADD PRIMARY KEY (crash_record_id, crash_date);
+
+CREATE TABLE people_raw (LIKE people_raw_unpartitioned)
+    PARTITION BY RANGE (crash_date);
+ALTER TABLE people_raw
+    ADD PRIMARY KEY (person_id, crash_date);
+
+DO $$
+BEGIN
+    FOR year IN 2013..2030 LOOP
+        EXECUTE format(
+            'CREATE TABLE crashes_raw_%s PARTITION OF crashes_raw '
+            || 'FOR VALUES FROM (%L) TO (%L)',
+            year, make_date(year, 1, 1), make_date(year + 1, 1, 1));
+        EXECUTE format(
+            'CREATE TABLE people_raw_%s PARTITION OF people_raw '
+            || 'FOR VALUES FROM (%L) TO (%L)',
+            year, make_date(year, 1, 1), make_date(year + 1, 1, 1));
+    END LOOP;
+END $$;
+
+CREATE TABLE crashes_raw_default PARTITION OF crashes_raw DEFAULT;
+CREATE TABLE people_raw_default PARTITION OF people_raw DEFAULT;
+
+CREATE INDEX crashes_raw_crash_date_idx ON crashes_raw (crash_date);
+CREATE INDEX people_raw_crash_record_id_idx ON people_raw (crash_record_id);
+
+-- Rows with a NULL or duplicate key cannot be kept; report how many
+DO $$
+DECLARE
+    num_rows BIGINT;
+    num_inserted BIGINT;
+BEGIN
+    INSERT INTO crashes_raw
+    SELECT *
+    FROM crashes_raw_unpartitioned
+    WHERE crash_record_id IS NOT NULL AND crash_date IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS num_inserted = ROW_COUNT;
+    SELECT COUNT(*) INTO num_rows FROM crashes_raw_unpartitioned;
+    RAISE NOTICE 'Discarded % of % crashes_raw rows with bad keys',
+        num_rows - num_inserted, num_rows;
+
+    INSERT INTO people_raw
+    SELECT *
+    FROM people_raw_unpartitioned
+    WHERE person_id IS NOT NULL AND crash_date IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS num_inserted = ROW_COUNT;
+    SELECT COUNT(*) INTO num_rows FROM people_raw_unpartitioned;
+    RAISE NOTICE 'Discarded % of % people_raw rows with bad keys',
+        num_rows - num_inserted, num_rows;
+END $$;
+
+DROP TABLE crashes_raw_unpartitioned;
+DROP TABLE people_raw_unpartitioned;
@@ -0,0 +1,14 @@
+-- When each crash was first loaded. crashes_raw is truncated and reloaded
+-- on every collection, so the load records new crash_record_ids here
+
+CREATE TABLE crash_ingest_log (
+    crash_record_id VARCHAR PRIMARY KEY,
+    ingested_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX crash_ingest_log_ingested_at_idx
+    ON crash_ingest_log (ingested_at);
+
+INSERT INTO crash_ingest_log (crash_record_id)
+SELECT DISTINCT crash_record_id
+FROM crashes_raw;
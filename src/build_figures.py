@@ -0,0 +1,355 @@
+import matplotlib
+matplotlib.use("Agg")
+
+import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.axes import Axes
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import path
+import hashlib
+import inspect
+import json
+
+from typing import Dict, List, Tuple, Union
+
+import plotting_functions
+from plotting_functions import (
+    injury_vs_no_injury_plot, rewrite_yaxis_labels, save_plot)
+
+MANIFEST_PATH = "./images/figure-manifest.json"
+
+FIGURES = [
+    {"name": "percent-accidents-by-traffic-control-device",
+        "plot_kwargs": {"feature_to_plot": "traffic_control_device",
+            "base_feature": "injury_category", "figsize": (14, 7),
+            "title": "Percent of Accidents by Traffic Control Device",
+            "xlabel": "Injury Category", "ylabel": "Percent of Group",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.6,
+            "num_points": 7}},
+    {"name": "percent-accidents-by-control-device-condition",
+        "plot_kwargs": {"feature_to_plot": "device_condition",
+            "base_feature": "injury_category", "figsize": (10, 7),
+            "title": "Percent of Accidents by Condition of Control Device",
+            "xlabel": "Injury Category", "ylabel": "Percent of Group",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.6,
+            "num_points": 7}},
+    {"name": "percent-accidents-by-lighting-condition",
+        "plot_kwargs": {"feature_to_plot": "lighting_condition",
+            "base_feature": "injury_category", "figsize": (10, 7),
+            "title": "Percent of Accidents by Lighting Condition",
+            "xlabel": "Injury Category", "ylabel": "Percent of Group",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.6,
+            "num_points": 7}},
+    {"name": "percent-accidents-by-traffic-way-type",
+        "plot_kwargs": {"feature_to_plot": "trafficway_type",
+            "base_feature": "injury_category",
+            "title": "Number of Accidents by Traffic Way Type",
+            "xlabel": "Injury Category", "ylabel": "Percent of Groups",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.4,
+            "num_points": 5}},
+    {"name": "percent-accidents-road-alignment",
+        "plot_kwargs": {"feature_to_plot": "alignment",
+            "base_feature": "injury_category",
+            "title": "Percent of Accidents by Road Alignment",
+            "xlabel": "Injury Category", "ylabel": "Percent of Groups",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 1.0,
+            "num_points": 6}},
+    {"name": "percent-accidents-roadway-condition",
+        "plot_kwargs": {"feature_to_plot": "roadway_surface_cond",
+            "base_feature": "injury_category",
+            "title": "Percent of Accidents by Roadway Condition",
+            "xlabel": "Injury Category", "ylabel": "Percent of Groups",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.8,
+            "num_points": 9}},
+    {"name": "percent-accidents-by-road-defect",
+        "plot_kwargs": {"feature_to_plot": "road_defect",
+            "base_feature": "injury_category",
+            "title": "Percent of Accidents by Road Defect",
+            "xlabel": "Injury Category", "ylabel": "Percent of Groups",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.8,
+            "num_points": 5}},
+    {"name": "percent-accidents-by-street-direction",
+        "plot_kwargs": {"feature_to_plot": "street_direction",
+            "base_feature": "injury_category",
+            "title": "Percent of Accidents by Street Direction",
+            "xlabel": "Injury Category", "ylabel": "Percent of Groups",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.4,
+            "num_points": 9}},
+    {"name": "percent-accidents-day-of-week",
+        "plot_kwargs": {"feature_to_plot": "crash_day_of_week",
+            "base_feature": "injury_category",
+            "title": "Percent of Accidents by Day of Week",
+            "xlabel": "Injury Category", "ylabel": "Percent of Groups",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.16,
+            "num_points": 9}},
+    {"name": "percent-accidents-by-month",
+        "plot_kwargs": {"feature_to_plot": "crash_month",
+            "base_feature": "injury_category",
+            "title": "Percent of Accidents by Month",
+            "xlabel": "Injury Category", "ylabel": "Percent of Groups",
+            "percents": True},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.1,
+            "num_points": 6}},
+    {"name": "percent-accidents-with-injuries",
+        "render": "percent_with_injuries",
+        "columns": ["has_injuries"],
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.8,
+            "num_points": 5}},
+    {"name": "percent-accidents-with-injuries-by-number-injuries",
+        "render": "percent_by_number_injuries",
+        "columns": ["has_injuries", "injuries_total"],
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.7,
+            "num_points": 8}},
+    {"name": "num-accidents-by-injury-category",
+        "render": "count_by_injury_category",
+        "columns": ["injury_category"],
+        "yaxis_kwargs": {"percent": False, "start": 100_000,
+            "stop": 400_000, "step": 100_000}},
+    {"name": "percent-accidents-by-traffic-control-device-top-3",
+        "render": "top_category_percents",
+        "columns": ["crash_record_id", "injury_category",
+            "traffic_control_device"],
+        "top_kwargs": {"feature_to_plot": "traffic_control_device",
+            "keep": "all", "threshold": 0.05,
+            "title": "Percent of Accidents by Top 3 Traffic Control Device"},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.6,
+            "num_points": 7}},
+    {"name": "percent-accidents-by-crash-type-top-8",
+        "render": "top_category_percents",
+        "columns": ["crash_record_id", "injury_category", "first_crash_type"],
+        "top_kwargs": {"feature_to_plot": "first_crash_type",
+            "keep": "any", "threshold": 0.05,
+            "title": "Percent of Accidents by Top 8 First Crash Types"},
+        "yaxis_kwargs": {"percent": True, "start": 0.0, "stop": 0.30,
+            "num_points": 7}},
+]
+
+
+def prepare_plot_data(df: pd.DataFrame) -> pd.DataFrame:
+    """Add the injury columns and ordered categories used by the plots."""
+    df = df.copy()
+    df["has_injuries"] = np.where(df["injuries_total"]==0, False, True)
+    df["crash_day_of_week"] = pd.Categorical(
+        df["crash_day_of_week"],
+        categories=["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday",
+            "Friday", "Saturday"],
+        ordered=True)
+    df["crash_month"] = pd.Categorical(
+        df["crash_month"],
+        categories=['January', 'February', 'March', 'April', 'May', 'June',
+        'July', 'August', 'September', 'October', 'November', 'December'],
+        ordered=True)
+    df["injury_category"] = np.select(
+        [df["injuries_total"] == 0,
+            df["injuries_total"] == 1,
+            df["injuries_total"] == 2,
+            df["injuries_total"] > 2,],
+        ["0 Injuries", "1 Injury", "2 Injuries", "3+ Injuries"],
+        default="0")
+    df["injury_category"] = pd.Categorical(
+        df["injury_category"],
+        categories=["0 Injuries", "1 Injury", "2 Injuries", "3+ Injuries"],
+        ordered=True)
+    return df
+
+def figure_columns(figure: Dict) -> List[str]:
+    """Return the columns of the plot data a figure depends on."""
+    if "columns" in figure:
+        return figure["columns"]
+    plot_kwargs = figure["plot_kwargs"]
+    base_feature = plot_kwargs.get("base_feature", "has_injuries")
+    return ["crash_record_id", base_feature, plot_kwargs["feature_to_plot"]]
+
+def plotting_code_fingerprint(figure: Dict) -> str:
+    """Hash the source of the code that draws a figure, so code changes
+    re-render only the figures they affect."""
+    hasher = hashlib.sha256()
+    with open(plotting_functions.__file__, "rb") as f:
+        hasher.update(f.read())
+    for func in (
+            RENDERERS[figure.get("render", "injury_comparison")],
+            render_figure):
+        hasher.update(inspect.getsource(func).encode("utf-8"))
+    return hasher.hexdigest()
+
+def figure_fingerprint(df: pd.DataFrame, figure: Dict) -> str:
+    """Hash the input data, plotting parameters and plotting code of a
+    figure."""
+    hasher = hashlib.sha256()
+    hashed_rows = pd.util.hash_pandas_object(
+        df[figure_columns(figure)], index=False)
+    hasher.update(hashed_rows.values.tobytes())
+    hasher.update(json.dumps(figure, sort_keys=True).encode("utf-8"))
+    hasher.update(plotting_code_fingerprint(figure).encode("utf-8"))
+    return hasher.hexdigest()
+
+def load_manifest(manifest_path: str=MANIFEST_PATH) -> Dict[str, str]:
+    """Load the fingerprints of previously rendered figures."""
+    if not path.exists(manifest_path):
+        return dict()
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+def save_manifest(
+        manifest: Dict[str, str], manifest_path: str=MANIFEST_PATH) -> None:
+    """Save the fingerprints of rendered figures."""
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    return None
+
+def render_injury_comparison(
+        df: pd.DataFrame, figure: Dict) -> Tuple[Figure, Axes]:
+    """Draw a grouped bar chart of a feature by injury group."""
+    return injury_vs_no_injury_plot(df, **figure["plot_kwargs"])
+
+def render_percent_with_injuries(
+        df: pd.DataFrame, figure: Dict) -> Tuple[Figure, Axes]:
+    """Draw the percent of accidents with and without injuries."""
+    fig, ax = plt.subplots(figsize=(8, 5))
+    (df["has_injuries"]
+        .value_counts(dropna=False, normalize=True)
+        .plot(kind="bar", ax=ax))
+    ax.set_title("Percent of Accidents with an Injury")
+    ax.set_xlabel("Crash Resulted in Injury")
+    ax.set_ylabel("Percent of Accidents")
+    ax.set_xticklabels(["No", "Yes"])
+    return fig, ax
+
+def render_percent_by_number_injuries(
+        df: pd.DataFrame, figure: Dict) -> Tuple[Figure, Axes]:
+    """Draw the percent of injury accidents by number of injuries."""
+    perc_num_accidents = (df
+        .loc[df["has_injuries"]==True, "injuries_total"]
+        .value_counts(dropna=False, normalize=True))
+    perc_num_accidents = perc_num_accidents.reindex(
+        index=perc_num_accidents.index.values.astype(int))
+    perc_num_accidents = perc_num_accidents.sort_index()
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+    perc_num_accidents.plot(kind="bar", ax=ax)
+    ax.set_title("Percent Accidents with Injuries by Number of Injuries")
+    ax.set_xlabel("Number of Injuries")
+    ax.set_ylabel("Percent of Accidents")
+    return fig, ax
+
+def render_count_by_injury_category(
+        df: pd.DataFrame, figure: Dict) -> Tuple[Figure, Axes]:
+    """Draw the number of accidents in each injury category."""
+    fig, ax = plt.subplots(figsize=(8, 5))
+    df["injury_category"].value_counts().plot(kind="bar", ax=ax)
+    ax.set_title("Number of Accidents by Injury Category")
+    ax.set_xlabel("Injury Category")
+    ax.set_ylabel("Number of Accidents")
+    return fig, ax
+
+def render_top_category_percents(
+        df: pd.DataFrame, figure: Dict) -> Tuple[Figure, Axes]:
+    """Draw the percent of each injury category for the feature values
+    above a share threshold in all or any of the categories."""
+    top_kwargs = figure["top_kwargs"]
+    feature_to_plot = top_kwargs["feature_to_plot"]
+    perc = (
+        (df.groupby(["injury_category", feature_to_plot])["crash_record_id"]
+            .count())
+        / (df.groupby(["injury_category"])["crash_record_id"].count()))
+    perc = (perc.reset_index()
+        .set_index("injury_category")
+        .pivot(columns=feature_to_plot, values="crash_record_id")
+        .fillna(0.0))
+    above = perc > top_kwargs["threshold"]
+    keep = above.all() if top_kwargs["keep"] == "all" else above.any()
+
+    fig, ax = plt.subplots(figsize=(10, 7))
+    perc.loc[:, keep.values].plot(kind="bar", ax=ax)
+    ax.set_title(top_kwargs["title"])
+    ax.set_xlabel("Injury Category")
+    ax.set_ylabel("Percent of Group")
+    ax.legend(title=None, loc="upper left", bbox_to_anchor=(1, 1))
+    return fig, ax
+
+RENDERERS = {
+    "injury_comparison": render_injury_comparison,
+    "percent_with_injuries": render_percent_with_injuries,
+    "percent_by_number_injuries": render_percent_by_number_injuries,
+    "count_by_injury_category": render_count_by_injury_category,
+    "top_category_percents": render_top_category_percents,
+}
+
+def render_figure(df: pd.DataFrame, figure: Dict) -> str:
+    """Render and save a single figure."""
+    render = RENDERERS[figure.get("render", "injury_comparison")]
+    with plt.style.context("ggplot"):
+        fig, ax = render(df, figure)
+        if figure.get("yaxis_kwargs"):
+            fig, ax = rewrite_yaxis_labels(fig, ax, **figure["yaxis_kwargs"])
+        save_plot(figure["name"], notebook=False)
+    plt.close(fig)
+    return figure["name"]
+
+def build_figures(
+        df: pd.DataFrame, figures: List[Dict]=FIGURES, force: bool=False,
+        max_workers: Union[None, int]=None,
+        manifest_path: str=MANIFEST_PATH) -> List[str]:
+    """Render figures in a process pool, skipping figures whose data and
+    parameters have not changed since the last build."""
+    df = prepare_plot_data(df)
+    manifest = load_manifest(manifest_path)
+
+    to_render = []
+    fingerprints = dict()
+    for figure in figures:
+        name = figure["name"]
+        fingerprints[name] = figure_fingerprint(df, figure)
+        image_path = "./images/" + name + ".png"
+        if (not force and manifest.get(name) == fingerprints[name]
+                and path.exists(image_path)):
+            print(f"Skipping unchanged figure {name}...")
+            continue
+        to_render.append(figure)
+
+    rendered = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                render_figure, df[figure_columns(figure)], figure)
+            for figure in to_render]
+        for future in as_completed(futures):
+            name = future.result()
+            print(f"Rendered figure {name}...")
+            manifest[name] = fingerprints[name]
+            rendered.append(name)
+            # Save as figures finish so a later failure keeps their entries
+            save_manifest(manifest, manifest_path)
+
+    return rendered
+
+
+if __name__ == "__main__":
+    from raw_to_transformed_data import get_sql_data
+
+    print("Starting program...")
+
+    query_crashes = """
+        SELECT *
+        FROM crashes;
+        """
+    dbname = "chi-traffic-accidents"
+    print("Accessing data from database...")
+    df_crashes = get_sql_data(dbname, query_crashes)
+
+    print("Building figures...")
+    build_figures(df_crashes)
+
+    print("Program complete.")
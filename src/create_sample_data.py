@@ -1,21 +1,146 @@
 import pandas as pd
-from raw_to_transformed_data import get_sql_data
+
+import random
+from typing import Dict, List, Literal, Tuple, Union
+
+from raw_to_transformed_data import (
+    get_sql_data, pooled_connection, close_pools)
+
+Stratum = Tuple[int, str]
+
+
+def get_stratum_counts(
+        db_name: str, table_name: str="crashes_joined") -> Dict[Stratum, int]:
+    """Count rows in each injury/no-injury and crash month stratum."""
+    query = f"""
+        SELECT has_injuries, crash_month, COUNT(*) AS num_rows
+        FROM {table_name}
+        GROUP BY has_injuries, crash_month;"""
+    df_counts = get_sql_data(db_name, query)
+    return {
+        (int(row.has_injuries), str(row.crash_month)): int(row.num_rows)
+        for row in df_counts.itertuples(index=False)}
+
+def allocate_sample_sizes(
+        stratum_counts: Dict[Stratum, int],
+        sample_size: int) -> Dict[Stratum, int]:
+    """Split the sample size across strata in proportion to their counts."""
+    total = sum(stratum_counts.values())
+    sample_size = min(sample_size, total)
+    exact = {
+        stratum: sample_size * count / total
+        for stratum, count in stratum_counts.items()}
+    allocation = {stratum: int(size) for stratum, size in exact.items()}
+
+    # Hand out the rows lost to rounding down by largest remainder
+    remaining = sample_size - sum(allocation.values())
+    by_remainder = sorted(
+        exact, key=lambda stratum: exact[stratum] - allocation[stratum],
+        reverse=True)
+    for stratum in by_remainder[:remaining]:
+        allocation[stratum] += 1
+    return allocation
+
+def stream_stratified_sample(
+        db_name: str, allocation: Dict[Stratum, int],
+        table_name: str="crashes_joined", batch_size: int=10_000,
+        seed: Union[None, int]=None) -> pd.DataFrame:
+    """Reservoir sample each stratum while streaming the table through a
+    server-side cursor."""
+    rng = random.Random(seed)
+    reservoirs = {stratum: [] for stratum in allocation}
+    seen = {stratum: 0 for stratum in allocation}
+
+    columns = None
+    with pooled_connection(db_name) as conn:
+        cursor = conn.cursor(name="stratified_sample_cursor")
+        cursor.itersize = batch_size
+        cursor.execute(f"SELECT * FROM {table_name};")
+
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            if columns is None:
+                columns = [desc[0] for desc in cursor.description]
+                injuries_idx = columns.index("has_injuries")
+                month_idx = columns.index("crash_month")
+
+            for row in rows:
+                stratum = (int(row[injuries_idx]), str(row[month_idx]))
+                quota = allocation.get(stratum, 0)
+                if quota == 0:
+                    continue
+                seen[stratum] += 1
+                reservoir = reservoirs[stratum]
+                if len(reservoir) < quota:
+                    reservoir.append(row)
+                else:
+                    idx = rng.randrange(seen[stratum])
+                    if idx < quota:
+                        reservoir[idx] = row
+            rows = cursor.fetchmany(batch_size)
+
+        cursor.close()
+
+    sample = [row for reservoir in reservoirs.values() for row in reservoir]
+    return pd.DataFrame.from_records(sample, columns=columns)
+
+def get_matching_people(
+        db_name: str, crash_record_ids: List[str],
+        table_name: str="people") -> pd.DataFrame:
+    """Retrieve the people rows for the sampled crashes."""
+    query = f"""
+        SELECT *
+        FROM {table_name}
+        WHERE crash_record_id = ANY(%(crash_record_ids)s);"""
+    with pooled_connection(db_name) as conn:
+        df = pd.read_sql(
+            query, conn, params={"crash_record_ids": list(crash_record_ids)})
+    return df
+
+def write_sample(
+        df: pd.DataFrame, path: str,
+        file_format: Literal["csv", "parquet"]="csv") -> None:
+    """Write a sample to a CSV or Parquet file."""
+    if file_format == "csv":
+        df.to_csv(path, index=False)
+    elif file_format == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        raise ValueError("`file_format` must be set to 'csv' or 'parquet'.")
+    return None
+
+def create_sample_data(
+        db_name: str, sample_size: int,
+        seed: Union[None, int]=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Create a stratified crashes sample and its matching people rows."""
+    print("Counting rows per stratum...")
+    stratum_counts = get_stratum_counts(db_name)
+    allocation = allocate_sample_sizes(stratum_counts, sample_size)
+
+    print("Sampling crashes data...")
+    df_crashes = stream_stratified_sample(db_name, allocation, seed=seed)
+
+    print("Retrieving matching people data...")
+    df_people = get_matching_people(
+        db_name, df_crashes["crash_record_id"].unique().tolist())
+    return df_crashes, df_people
 
 
 if __name__ == '__main__':
+    print("Starting program...")
+
     db_name = "chi-traffic-accidents"
-    query_crashes = """
-        SELECT *
-        FROM crashes_joined
-        LIMIT 100;"""
-    query_people = """
-        SELECT *
-        FROM people
-        LIMIT 100;"""
-    
-    df_crashes = get_sql_data(db_name, query_crashes)
-    df_people = get_sql_data(db_name, query_people)
-
-    df_crashes.to_csv("./data/crashes-data-sample.csv", index=False)
-    df_crashes.to_csv("./data/people-data-sample.csv", index=False)
-    
\ No newline at end of file
+    sample_size = 100
+    file_format = "csv"
+    seed = 42
+
+    df_crashes, df_people = create_sample_data(db_name, sample_size, seed)
+
+    print("Writing sample data...")
+    write_sample(
+        df_crashes, f"./data/crashes-data-sample.{file_format}", file_format)
+    write_sample(
+        df_people, f"./data/people-data-sample.{file_format}", file_format)
+    close_pools()
+
+    print("Program complete.")
@@ -0,0 +1,243 @@
+import pandas as pd
+import numpy as np
+
+from os import path
+import json
+import joblib
+
+from typing import Any, Dict, Union
+
+from prediction_model import (
+    NUMERIC_COLS, COLUMN_MAP, FILL_MODE_COLS, get_category_cols)
+from raw_to_transformed_data import get_sql_data, pooled_connection
+
+TRAINING_STATS_PATH = "./models/training-stats.json"
+MONITOR_STATE_PATH = "./models/drift-monitor-state.json"
+ENCODER_PATH = "./models/encoder.pkl"
+
+# Feature columns of crashes loaded after the watermark, read through the
+# ingest log that SodaClient fills at load time
+RAW_FEATURES_QUERY = """
+    SELECT l.ingested_at, c.crash_date, c.traffic_control_device,
+        c.device_condition, c.weather_condition, c.lighting_condition,
+        c.first_crash_type, c.trafficway_type, c.alignment,
+        c.roadway_surface_cond, c.road_defect, c.street_direction,
+        c.posted_speed_limit::INTEGER AS posted_speed_limit,
+        c.num_units::INTEGER AS num_units,
+        c.crash_hour::INTEGER AS crash_hour
+    FROM crash_ingest_log AS l
+    JOIN crashes_raw AS c ON c.crash_record_id = l.crash_record_id
+    WHERE l.ingested_at > %(watermark)s
+    ORDER BY l.ingested_at;
+    """
+
+MAX_INGESTED_AT_QUERY = """
+    SELECT MAX(ingested_at) AS max_ingested_at
+    FROM crash_ingest_log;
+    """
+
+TRAINING_ROWS_QUERY = """
+    SELECT *
+    FROM crashes_joined
+    WHERE (%(start)s IS NULL OR crash_date >= %(start)s)
+        AND (%(stop)s IS NULL OR crash_date < %(stop)s);
+    """
+
+
+def get_max_ingested_at(dbname: str) -> Union[None, str]:
+    """Return when the latest crash was loaded."""
+    max_ingested_at = get_sql_data(
+        dbname, MAX_INGESTED_AT_QUERY)["max_ingested_at"].iloc[0]
+    return None if pd.isna(max_ingested_at) else str(max_ingested_at)
+
+def compute_training_stats(
+        X: pd.DataFrame, encoder: Any, num_bins: int=20,
+        max_ingested_at: Union[None, str]=None) -> Dict[str, Dict]:
+    """Compute category frequencies and numeric histograms of the features
+    the served model uses. The monitor treats crashes loaded up to
+    `max_ingested_at` as already seen."""
+    categorical = dict()
+    for col in get_category_cols(encoder):
+        counts = X[col].value_counts()
+        categorical[col] = {
+            str(key): int(value) for key, value in counts.items()}
+
+    numeric = dict()
+    for col in NUMERIC_COLS:
+        values = X[col].dropna().to_numpy(dtype=float)
+        edges = np.linspace(values.min(), values.max(), num_bins + 1)
+        counts, _ = np.histogram(values, bins=edges)
+        numeric[col] = {"edges": edges.tolist(), "counts": counts.tolist()}
+
+    return {
+        "categorical": categorical, "numeric": numeric,
+        "max_ingested_at": max_ingested_at}
+
+def bootstrap_training_stats(
+        dbname: str, encoder: Any, start: Union[None, str]=None,
+        stop: Union[None, str]=None) -> Dict[str, Dict]:
+    """Compute training stats from crashes_joined for a saved encoder,
+    preparing the features as model.py does without refitting anything.
+    `start` and `stop` limit the crash dates used."""
+    with pooled_connection(dbname) as conn:
+        df = pd.read_sql(
+            TRAINING_ROWS_QUERY, conn, params={"start": start, "stop": stop})
+    df = df.rename(columns={value: key for key, value in COLUMN_MAP.items()})
+    for col in FILL_MODE_COLS:
+        df[col] = df[col].fillna(df[col].mode()[0])
+    return compute_training_stats(
+        df, encoder, max_ingested_at=get_max_ingested_at(dbname))
+
+def save_training_stats(
+        stats: Dict[str, Dict], stats_path: str=TRAINING_STATS_PATH) -> None:
+    """Save training stats next to the model artifacts."""
+    with open(stats_path, "w") as f:
+        json.dump(stats, f, indent=4)
+    return None
+
+def population_stability_index(
+        expected: np.ndarray, actual: np.ndarray,
+        epsilon: float=1e-4) -> float:
+    """Compute the population stability index between two sets of counts."""
+    expected = expected / max(expected.sum(), 1)
+    actual = actual / max(actual.sum(), 1)
+    expected = np.clip(expected, epsilon, None)
+    actual = np.clip(actual, epsilon, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+class DriftMonitor:
+    """
+    Track running category frequencies and numeric histograms of newly
+    ingested crashes and compare them against the training data.
+    """
+
+    def __init__(
+            self, dbname: str="chi-traffic-accidents",
+            stats_path: str=TRAINING_STATS_PATH,
+            state_path: str=MONITOR_STATE_PATH,
+            encoder_path: str=ENCODER_PATH,
+            psi_threshold: float=0.2) -> None:
+        """Initialize the monitor from the training stats and saved state.
+        Stats missing for the deployed model are computed from
+        crashes_joined."""
+        self.dbname = dbname
+        self.state_path = state_path
+        self.psi_threshold = psi_threshold
+
+        if not path.exists(stats_path):
+            print("Computing training stats for the saved encoder...")
+            save_training_stats(
+                bootstrap_training_stats(dbname, joblib.load(encoder_path)),
+                stats_path)
+        with open(stats_path, "r") as f:
+            self.training_stats = json.load(f)
+
+        if path.exists(state_path):
+            with open(state_path, "r") as f:
+                self.state = json.load(f)
+        else:
+            self.state = {
+                "watermark": (
+                    self.training_stats.get("max_ingested_at")
+                    or "1900-01-01 00:00:00"),
+                "num_rows": 0,
+                "categorical": {
+                    col: dict()
+                    for col in self.training_stats["categorical"]},
+                "numeric": {
+                    col: {"counts": [0] * len(stats["counts"]),
+                        "below": 0, "above": 0}
+                    for col, stats in self.training_stats["numeric"].items()}}
+
+        return None
+
+    def get_new_rows(self) -> pd.DataFrame:
+        """Fetch crashes loaded after the watermark."""
+        with pooled_connection(self.dbname) as conn:
+            df = pd.read_sql(
+                RAW_FEATURES_QUERY, conn,
+                params={"watermark": self.state["watermark"]})
+        df["crash_date"] = pd.to_datetime(df["crash_date"])
+        df["crash_day"] = df["crash_date"].dt.day_name()
+        df["crash_month"] = df["crash_date"].dt.month_name()
+        return df
+
+    def update(self, df: Union[None, pd.DataFrame]=None) -> int:
+        """Add new rows to the running stats and advance the watermark."""
+        if df is None:
+            df = self.get_new_rows()
+        if len(df) == 0:
+            return 0
+
+        for col, counts in self.state["categorical"].items():
+            for key, value in df[col].value_counts().items():
+                counts[str(key)] = counts.get(str(key), 0) + int(value)
+
+        for col, hist in self.state["numeric"].items():
+            edges = np.array(self.training_stats["numeric"][col]["edges"])
+            values = df[col].dropna().to_numpy(dtype=float)
+            counts, _ = np.histogram(values, bins=edges)
+            hist["counts"] = (np.array(hist["counts"]) + counts).tolist()
+            hist["below"] += int((values < edges[0]).sum())
+            hist["above"] += int((values > edges[-1]).sum())
+
+        self.state["num_rows"] += len(df)
+        self.state["watermark"] = str(df["ingested_at"].max())
+        self.save_state()
+        return len(df)
+
+    def save_state(self) -> None:
+        """Save the running stats and watermark."""
+        with open(self.state_path, "w") as f:
+            json.dump(self.state, f, indent=4)
+        return None
+
+    def report(self) -> pd.DataFrame:
+        """Compare running stats with training stats for each feature."""
+        rows = []
+        for col, counts in self.state["categorical"].items():
+            training = self.training_stats["categorical"][col]
+            unseen = sorted(set(counts) - set(training))
+            keys = sorted(set(counts) | set(training))
+            psi = population_stability_index(
+                np.array([training.get(key, 0) for key in keys], dtype=float),
+                np.array([counts.get(key, 0) for key in keys], dtype=float))
+            rows.append({
+                "feature": col, "psi": psi, "unseen": unseen,
+                "num_unseen": sum(counts[key] for key in unseen)})
+
+        for col, hist in self.state["numeric"].items():
+            training = self.training_stats["numeric"][col]["counts"]
+            psi = population_stability_index(
+                np.array([0] + training + [0], dtype=float),
+                np.array(
+                    [hist["below"]] + hist["counts"] + [hist["above"]],
+                    dtype=float))
+            rows.append({
+                "feature": col, "psi": psi, "unseen": [],
+                "num_unseen": hist["below"] + hist["above"]})
+
+        df_report = pd.DataFrame(rows)
+        df_report["flagged"] = (
+            (df_report["psi"] > self.psi_threshold)
+            | (df_report["num_unseen"] > 0))
+        return df_report
+
+
+if __name__ == '__main__':
+    print("Starting program...")
+    drift_monitor = DriftMonitor()
+
+    print("Updating stats with new crashes...")
+    num_rows = drift_monitor.update()
+    print(f"Added {num_rows} new crashes.")
+
+    df_report = drift_monitor.report()
+    print(df_report)
+    for row in df_report.loc[df_report["flagged"]].itertuples(index=False):
+        print(
+            f"Drift flagged for {row.feature}: PSI {row.psi:.3f}, "
+            + f"unseen values {row.unseen}")
+
+    print("Program complete.")
@@ -0,0 +1,369 @@
+import pandas as pd
+import numpy as np
+
+from sklearn.linear_model import LinearRegression, Ridge, Lasso
+from sklearn.preprocessing import MinMaxScaler
+
+from os import path, makedirs, remove
+import hashlib
+import json
+import joblib
+
+from typing import Any, Dict, List, Literal, Tuple, Union
+
+from prediction_model import (
+    NUMERIC_COLS, COLUMN_MAP, FILL_MODE_COLS, get_category_cols)
+from raw_to_transformed_data import get_sql_data, pooled_connection
+from drift_monitor import bootstrap_training_stats, save_training_stats
+
+STATS_DIR = "./models/sufficient-stats"
+# Bumped when the layout of the stored statistics changes
+STATS_VERSION = 2
+
+# One fingerprint per month over every column the design matrix reads, so
+# only new or changed months are recomputed
+MONTH_FINGERPRINTS_QUERY = """
+    SELECT to_char(crash_date, 'YYYY-MM') AS month,
+        md5(string_agg(
+            ROW(crash_record_id, {columns})::TEXT, ','
+            ORDER BY crash_record_id)) AS fingerprint
+    FROM crashes_joined
+    WHERE crash_date IS NOT NULL
+    GROUP BY 1
+    ORDER BY 1;
+    """
+
+MONTH_ROWS_QUERY = """
+    SELECT *
+    FROM crashes_joined
+    WHERE crash_date >= %(start)s AND crash_date < %(stop)s;
+    """
+
+LinearModel = Union[LinearRegression, Ridge, Lasso]
+
+
+def get_feature_names(encoder: Any) -> List[str]:
+    """Return the model's feature names in the order PredictionModel
+    builds them."""
+    feature_names = list(NUMERIC_COLS)
+    category_cols = get_category_cols(encoder)
+    for col, categories in zip(category_cols, encoder.categories_):
+        for category in categories:
+            feature_names.append(col + "_" + category.lower())
+    return feature_names
+
+def get_month_fingerprints_query(
+        encoder: Any, target: str="injuries_total") -> str:
+    """Build the monthly fingerprint query over the feature and target
+    columns."""
+    feature_cols = NUMERIC_COLS + get_category_cols(encoder)
+    columns = [COLUMN_MAP.get(col, col) for col in feature_cols] + [target]
+    return MONTH_FINGERPRINTS_QUERY.format(columns=", ".join(columns))
+
+def build_design_matrix(df: pd.DataFrame, encoder: Any) -> np.ndarray:
+    """Build the unscaled design matrix with a leading intercept column.
+    Each category block ends with a column flagging missing values, which
+    `fold_missing_values` maps to the value model.py fills them with.
+    Values the encoder has not seen are encoded as all zeros."""
+    df = df.rename(columns={value: key for key, value in COLUMN_MAP.items()})
+    blocks = [np.ones((len(df), 1)), df[NUMERIC_COLS].to_numpy(dtype=float)]
+    category_cols = get_category_cols(encoder)
+    for col, categories in zip(category_cols, encoder.categories_):
+        codes = pd.Categorical(df[col], categories=categories).codes
+        onehot = np.zeros((len(df), len(categories) + 1))
+        known = codes >= 0
+        onehot[np.where(known)[0], codes[known]] = 1.0
+        onehot[:, -1] = df[col].isna().to_numpy()
+        blocks.append(onehot)
+    return np.hstack(blocks)
+
+def compute_sufficient_stats(
+        df: pd.DataFrame, encoder: Any,
+        target: str="injuries_total"
+        ) -> Union[None, Dict[str, np.ndarray]]:
+    """Compute the normal equation terms and numeric bounds for a batch.
+    Returns None when no rows are left after dropping missing values."""
+    df = df.dropna(subset=NUMERIC_COLS + [target])
+    if len(df) == 0:
+        return None
+    Z = build_design_matrix(df, encoder)
+    y = df[target].to_numpy(dtype=float)
+    numeric = Z[:, 1:len(NUMERIC_COLS) + 1]
+    return {
+        "ztz": Z.T @ Z,
+        "zty": Z.T @ y,
+        "yty": np.array(y @ y),
+        "n": np.array(len(y)),
+        "mins": numeric.min(axis=0),
+        "maxs": numeric.max(axis=0)}
+
+def combine_stats(
+        stats_list: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """Sum the statistics of several partitions."""
+    return {
+        "ztz": sum(stats["ztz"] for stats in stats_list),
+        "zty": sum(stats["zty"] for stats in stats_list),
+        "yty": sum(stats["yty"] for stats in stats_list),
+        "n": sum(stats["n"] for stats in stats_list),
+        "mins": np.min([stats["mins"] for stats in stats_list], axis=0),
+        "maxs": np.max([stats["maxs"] for stats in stats_list], axis=0)}
+
+def fold_missing_values(
+        stats: Dict[str, np.ndarray], encoder: Any) -> Dict[str, np.ndarray]:
+    """Map the missing-value columns onto the model's columns. Missing
+    values of `FILL_MODE_COLS` count as the most common category, as
+    model.py fills them with the mode; others are dropped."""
+    num_model_cols = 1 + len(NUMERIC_COLS) + sum(
+        len(categories) for categories in encoder.categories_)
+    # Z_model = Z @ F, so Z_model^T Z_model = F^T Z^T Z F
+    F = np.zeros((stats["ztz"].shape[0], num_model_cols))
+    start = stop = 1 + len(NUMERIC_COLS)
+    F[:start, :start] = np.eye(start)
+    for col, categories in zip(
+            get_category_cols(encoder), encoder.categories_):
+        num_categories = len(categories)
+        F[start:start + num_categories, stop:stop + num_categories] = (
+            np.eye(num_categories))
+        if col in FILL_MODE_COLS:
+            # Diagonal terms of one-hot columns are category counts, and
+            # argmax breaks ties on the first sorted category like pandas
+            counts = np.diag(stats["ztz"])[start:start + num_categories]
+            F[start + num_categories, stop + np.argmax(counts)] = 1.0
+        start += num_categories + 1
+        stop += num_categories
+
+    folded = dict(stats)
+    folded["ztz"] = F.T @ stats["ztz"] @ F
+    folded["zty"] = F.T @ stats["zty"]
+    return folded
+
+def scale_stats(
+        stats: Dict[str, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Apply MinMax scaling to the normal equation terms. Scaling is an
+    affine map of the design matrix, so X^T X = T^T Z^T Z T."""
+    mins = stats["mins"]
+    ranges = stats["maxs"] - mins
+    ranges[ranges == 0] = 1.0
+
+    num_cols = stats["ztz"].shape[0]
+    T = np.eye(num_cols)
+    for j in range(len(NUMERIC_COLS)):
+        T[j + 1, j + 1] = 1.0 / ranges[j]
+        T[0, j + 1] = -mins[j] / ranges[j]
+    return T.T @ stats["ztz"] @ T, T.T @ stats["zty"]
+
+def center_stats(
+        xtx: np.ndarray, xty: np.ndarray, n: int
+        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+    """Return covariance terms so the intercept is left unpenalized."""
+    x_mean = xtx[0, 1:] / n
+    y_mean = xty[0] / n
+    cxx = xtx[1:, 1:] / n - np.outer(x_mean, x_mean)
+    cxy = xty[1:] / n - x_mean * y_mean
+    return cxx, cxy, x_mean, y_mean
+
+def lasso_from_gram(
+        cxx: np.ndarray, cxy: np.ndarray, alpha: float,
+        max_iter: int=1000, tol: float=1e-6) -> np.ndarray:
+    """Solve the lasso problem by coordinate descent on covariance terms."""
+    coefs = np.zeros(len(cxy))
+    for _ in range(max_iter):
+        max_change = 0.0
+        for j in range(len(cxy)):
+            if cxx[j, j] <= 0:
+                continue
+            rho = cxy[j] - cxx[j] @ coefs + cxx[j, j] * coefs[j]
+            new_coef = np.sign(rho) * max(abs(rho) - alpha, 0.0) / cxx[j, j]
+            max_change = max(max_change, abs(new_coef - coefs[j]))
+            coefs[j] = new_coef
+        if max_change < tol:
+            break
+    return coefs
+
+def fit_from_stats(
+        stats: Dict[str, np.ndarray], encoder: Any,
+        model_type: Literal["linear", "ridge", "lasso"]="linear",
+        alpha: float=1.0) -> Tuple[LinearModel, MinMaxScaler]:
+    """Fit a linear model and scaler from aggregated statistics. `alpha`
+    follows the scikit-learn definition for each model type."""
+    stats = fold_missing_values(stats, encoder)
+    n = int(stats["n"])
+    xtx, xty = scale_stats(stats)
+    cxx, cxy, x_mean, y_mean = center_stats(xtx, xty, n)
+
+    if model_type == "linear":
+        model = LinearRegression()
+        coefs = np.linalg.lstsq(cxx, cxy, rcond=None)[0]
+    elif model_type == "ridge":
+        model = Ridge(alpha=alpha)
+        coefs = np.linalg.solve(
+            n * cxx + alpha * np.eye(len(cxy)), n * cxy)
+    elif model_type == "lasso":
+        model = Lasso(alpha=alpha)
+        coefs = lasso_from_gram(cxx, cxy, alpha)
+    else:
+        raise ValueError(
+            "`model_type` must be set to 'linear', 'ridge', or 'lasso'.")
+
+    feature_names = get_feature_names(encoder)
+    model.coef_ = coefs
+    model.intercept_ = float(y_mean - x_mean @ coefs)
+    model.n_features_in_ = len(feature_names)
+    model.feature_names_in_ = np.array(feature_names, dtype=object)
+
+    scaler = MinMaxScaler()
+    scaler.fit(pd.DataFrame(
+        [stats["mins"], stats["maxs"]], columns=NUMERIC_COLS))
+    return model, scaler
+
+
+class SufficientStatsStore:
+    """
+    Store normal equation statistics per crash month and refresh only the
+    months whose data changed.
+    """
+
+    def __init__(
+            self, encoder_path: str="./models/encoder.pkl",
+            dbname: str="chi-traffic-accidents",
+            stats_dir: str=STATS_DIR) -> None:
+        """Initialize the store."""
+        self.encoder = joblib.load(encoder_path)
+        with open(encoder_path, "rb") as f:
+            self.encoder_hash = hashlib.sha256(f.read()).hexdigest()
+        self.dbname = dbname
+        self.stats_dir = stats_dir
+        self.manifest_path = path.join(stats_dir, "manifest.json")
+        makedirs(stats_dir, exist_ok=True)
+
+        self.manifest = {
+            "encoder": self.encoder_hash, "version": STATS_VERSION,
+            "months": dict()}
+        if path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            # Statistics built with another encoder or layout have other
+            # columns
+            if (manifest.get("encoder") == self.encoder_hash
+                    and manifest.get("version") == STATS_VERSION):
+                self.manifest = manifest
+
+        return None
+
+    def stats_path(self, month: str) -> str:
+        """Return the path of a month's statistics."""
+        return path.join(self.stats_dir, month + ".npz")
+
+    def save_manifest(self) -> None:
+        """Save the fingerprints of the stored months."""
+        with open(self.manifest_path, "w") as f:
+            json.dump(self.manifest, f, indent=4, sort_keys=True)
+        return None
+
+    def update(self) -> List[str]:
+        """Recompute statistics for new or changed months."""
+        df_months = get_sql_data(
+            self.dbname, get_month_fingerprints_query(self.encoder))
+        months = self.manifest["months"]
+        for month in set(months) - set(df_months["month"]):
+            print(f"Removing statistics for {month}...")
+            del months[month]
+            if path.exists(self.stats_path(month)):
+                remove(self.stats_path(month))
+
+        updated = []
+        for row in df_months.itertuples(index=False):
+            entry = months.get(row.month, dict())
+            if (entry.get("fingerprint") == row.fingerprint
+                    and (entry.get("num_rows") == 0
+                        or path.exists(self.stats_path(row.month)))):
+                continue
+
+            print(f"Computing statistics for {row.month}...")
+            start = pd.Timestamp(row.month + "-01")
+            stop = start + pd.DateOffset(months=1)
+            with pooled_connection(self.dbname) as conn:
+                df = pd.read_sql(
+                    MONTH_ROWS_QUERY, conn,
+                    params={"start": start.to_pydatetime(),
+                        "stop": stop.to_pydatetime()})
+            stats = compute_sufficient_stats(df, self.encoder)
+            if stats is None:
+                # Every row has missing values, so nothing to store
+                num_rows = 0
+                if path.exists(self.stats_path(row.month)):
+                    remove(self.stats_path(row.month))
+            else:
+                num_rows = int(stats["n"])
+                np.savez(self.stats_path(row.month), **stats)
+
+            months[row.month] = {
+                "fingerprint": row.fingerprint, "num_rows": num_rows}
+            self.save_manifest()
+            updated.append(row.month)
+
+        return updated
+
+    def load(
+            self, start_month: Union[None, str]=None,
+            stop_month: Union[None, str]=None) -> Dict[str, np.ndarray]:
+        """Combine the statistics of months from `start_month` up to and
+        including `stop_month`, given as 'YYYY-MM'."""
+        months = [
+            month for month, entry in sorted(self.manifest["months"].items())
+            if entry["num_rows"] > 0
+            and (start_month is None or month >= start_month)
+            and (stop_month is None or month <= stop_month)]
+        if not months:
+            raise ValueError("No statistics stored for the selected months.")
+
+        stats_list = []
+        for month in months:
+            with np.load(self.stats_path(month)) as stats:
+                stats_list.append({key: stats[key] for key in stats.files})
+        return combine_stats(stats_list)
+
+
+if __name__ == '__main__':
+    print("Starting program...")
+
+    save_elements = False
+    start_month = None
+    stop_month = None
+    dbname = "chi-traffic-accidents"
+    lasso_path = "./models/lasso-reg-model.pkl"
+
+    store = SufficientStatsStore(dbname=dbname)
+    print("Updating monthly statistics...")
+    updated = store.update()
+    print(f"Updated {len(updated)} months.")
+
+    # LassoCV stores the penalty it chose as alpha_, a refit Lasso as alpha
+    saved_lasso = joblib.load(lasso_path)
+    if hasattr(saved_lasso, "alpha_"):
+        alpha = saved_lasso.alpha_
+    else:
+        alpha = saved_lasso.alpha
+
+    stats = store.load(start_month, stop_month)
+    print("Fitting models from statistics...")
+    model_lr, scaler = fit_from_stats(stats, store.encoder, "linear")
+    model_lasso, _ = fit_from_stats(stats, store.encoder, "lasso", alpha)
+
+    if save_elements:
+        print("Saving models and scaler...")
+        joblib.dump(model_lr, "./models/linear-reg-model.pkl")
+        joblib.dump(model_lasso, lasso_path)
+        joblib.dump(scaler, "./models/scaler.pkl")
+
+        # The drift monitor compares new crashes with the training window
+        print("Saving training stats...")
+        start = None if start_month is None else start_month + "-01"
+        stop = None
+        if stop_month is not None:
+            stop = str((pd.Timestamp(stop_month + "-01")
+                + pd.DateOffset(months=1)).date())
+        save_training_stats(
+            bootstrap_training_stats(dbname, store.encoder, start, stop))
+
+    print("Program complete.")
@@ -14,6 +14,8 @@ import time
 import joblib
 
 from raw_to_transformed_data import get_sql_data
+from drift_monitor import (
+    compute_training_stats, save_training_stats, get_max_ingested_at)
 
 np.set_printoptions(suppress=True)
 plt.style.use("ggplot")
@@ -21,56 +23,6 @@ plt.style.use("ggplot")
 ModelRegressor = Union[
     LinearRegression, RandomForestRegressor, GradientBoostingRegressor]
 
-class PredictionModel:
-    """Create and implement model used for predicting results."""
-
-    def __init__(
-            self, model_path: str, scalar_path: Union[None, str]=None, 
-            encoder_path: Union[None, str]=None) -> None:
-        """Initialize PredictionModel object."""
-        self.model_ = joblib.load(model_path)
-        if scalar_path:
-            self.scalar_ = joblib.load(scalar_path)
-        if encoder_path:
-            self.encoder_ = joblib.load(encoder_path)
-        
-        return None
-    
-    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
-        """Transform X for use in predictions."""
-        numeric_cols = ["posted_speed_limit", "num_units", "crash_hour"]
-        category_cols = X.columns.difference(numeric_cols)
-
-        # Transform numeric columns
-        continuous = X[numeric_cols].copy()
-        X = X.drop(columns=numeric_cols)
-        scalar = self.scalar_
-        transformed = scalar.transform(continuous)
-        transformed = pd.DataFrame(transformed, columns=numeric_cols)
-        X = pd.concat([X, transformed], axis=1)
-
-        # Transform categorical columns
-        encoder = self.encoder_
-        transformed = encoder.transform(X[category_cols])
-        matrix_cols = []
-        for col, ele in zip(category_cols, encoder.categories_):
-            for e in ele:
-                matrix_cols.append(col + "_" + e.lower())
-        X = pd.concat(
-            [X[numeric_cols].reset_index(drop=True), pd.DataFrame(
-                transformed.toarray(), columns=matrix_cols)], 
-            axis=1)
-        
-        return X
-
-    def predict(self, X) -> pd.DataFrame:
-        """Predict value(s)."""
-        model = self.model_
-        y_pred = model.predict(X)
-        y_pred = np.clip(y_pred, a_min=0, a_max=None)
-        y_pred = np.round(y_pred, 0)
-        return y_pred.astype(int)
-
 def cv_regression_model(
         model: ModelRegressor, X: pd.DataFrame, y: pd.DataFrame, 
         scoring: str="neg_mean_squared_error", 
@@ -312,6 +264,7 @@ if __name__ == '__main__':
             "num_pedestrians_involved", "num_ejected"]
     else:
         drop_additional = []
+    max_ingested_at = get_max_ingested_at(dbname)
     df_crashes = df_crashes.drop(columns=drop_cols+drop_additional)
 
     df_crashes = df_crashes.rename(columns={"crash_day_of_week": "crash_day"})
@@ -332,6 +285,9 @@ if __name__ == '__main__':
             "num_bikes_involved", "num_pedestrians_involved", 
             "num_extricated", "num_ejected"]
     
+    # Keep the untransformed features for the drift monitor's stats
+    X_features = X
+
     # MinMax scale
     continuous = X[numeric_cols].copy()
     X = X.drop(columns=numeric_cols)
@@ -358,6 +314,9 @@ if __name__ == '__main__':
     if save_elements:
         print("Saving encoder...")
         joblib.dump(encoder, "./models/encoder.pkl")
+        print("Saving training stats...")
+        save_training_stats(compute_training_stats(
+            X_features, encoder, max_ingested_at=max_ingested_at))
     
     print("Creating train-test split...")
     X_train, X_test, y_train, y_test = train_test_split(X, y)
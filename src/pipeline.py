@@ -0,0 +1,228 @@
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from os import path, makedirs
+from threading import Lock
+import hashlib
+import sys
+import json
+
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from raw_to_transformed_data import (
+    transform_and_store_data, join_people_to_crashes, close_pools,
+    get_sql_data,
+    CRASHES_RAW_QUERY, PEOPLE_RAW_QUERY, CRASHES_COL_TYPES, PEOPLE_COL_TYPES)
+
+CACHE_DIR = "./data/pipeline-cache"
+
+# Cheap summary of a raw table, used as the input of a transform stage
+RAW_TABLE_FINGERPRINT_QUERY = """
+    SELECT COUNT(*) AS num_rows, MAX(crash_date) AS max_crash_date
+    FROM {table_name};
+    """
+
+
+class PipelineRunner:
+    """
+    Run pipeline stages as a DAG, running independent stages concurrently
+    and skipping stages whose inputs have not changed since the last run.
+    """
+
+    def __init__(
+            self, cache_dir: str=CACHE_DIR,
+            max_workers: int=4) -> None:
+        """Initialize the runner."""
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.manifest_path = path.join(cache_dir, "manifest.json")
+
+        self.stages = dict()
+        self.outputs = dict()
+        self.fingerprints = dict()
+        self._lock = Lock()
+
+        return None
+
+    def add_stage(
+            self, name: str, func: Callable[..., Any],
+            deps: Tuple[str, ...]=(),
+            fingerprint: Union[None, Callable[[], str]]=None,
+            params: Union[None, Dict[str, Any]]=None,
+            after: Tuple[str, ...]=()) -> None:
+        """Add a stage. `func` is called with the outputs of `deps` in order.
+        `fingerprint` returns a key for inputs outside the pipeline and
+        `params` holds settings that should invalidate the cache. `after`
+        lists stages that only need to finish first, such as a stage that
+        loads the table `fingerprint` summarizes."""
+        for dep in tuple(deps) + tuple(after):
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown '{dep}'.")
+        self.stages[name] = {
+            "func": func, "deps": tuple(deps), "after": tuple(after),
+            "fingerprint": fingerprint, "params": params or dict()}
+        return None
+
+    def compute_fingerprint(self, name: str) -> str:
+        """Chain a stage's fingerprint with those of its dependencies. The
+        dependencies' fingerprints must already be computed."""
+        stage = self.stages[name]
+        hasher = hashlib.sha256()
+        hasher.update(name.encode("utf-8"))
+        hasher.update(
+            json.dumps(stage["params"], sort_keys=True, default=str)
+                .encode("utf-8"))
+        if stage["fingerprint"] is not None:
+            hasher.update(str(stage["fingerprint"]()).encode("utf-8"))
+        for dep in stage["deps"]:
+            hasher.update(self.fingerprints[dep].encode("utf-8"))
+        return hasher.hexdigest()
+
+    def load_manifest(self) -> Dict[str, str]:
+        """Load the fingerprints of previously completed stages."""
+        if not path.exists(self.manifest_path):
+            return dict()
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest: Dict[str, str]) -> None:
+        """Save the fingerprints of completed stages."""
+        with open(self.manifest_path, "w") as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+        return None
+
+    def cache_path(self, name: str) -> str:
+        """Return the path of a stage's cached output."""
+        return path.join(self.cache_dir, name + ".pkl")
+
+    def get_output(self, name: str) -> Any:
+        """Return a stage's output, loading it from the cache if needed."""
+        with self._lock:
+            if name not in self.outputs:
+                self.outputs[name] = pd.read_pickle(self.cache_path(name))
+            return self.outputs[name]
+
+    def run_stage(
+            self, name: str, manifest: Dict[str, str], force: bool) -> bool:
+        """Run a single stage and cache its output unless its inputs are
+        unchanged. Returns whether the stage ran."""
+        # Fingerprints are computed once the stage is ready so they see
+        # what earlier stages wrote
+        fingerprint = self.compute_fingerprint(name)
+        with self._lock:
+            self.fingerprints[name] = fingerprint
+        if (not force and manifest.get(name) == fingerprint
+                and path.exists(self.cache_path(name))):
+            print(f"Skipping unchanged stage {name}...")
+            return False
+
+        stage = self.stages[name]
+        args = [self.get_output(dep) for dep in stage["deps"]]
+        print(f"Running stage {name}...")
+        output = stage["func"](*args)
+        pd.to_pickle(output, self.cache_path(name))
+        with self._lock:
+            self.outputs[name] = output
+        return True
+
+    def run(self, force: bool=False) -> List[str]:
+        """Run all stages whose inputs changed and return their names."""
+        makedirs(self.cache_dir, exist_ok=True)
+        manifest = self.load_manifest()
+        self.fingerprints = dict()
+
+        pending = set(self.stages)
+        done = set()
+        ran = []
+        running = dict()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                ready = [
+                    name for name in self.stages if name in pending
+                    and set(self.stages[name]["deps"]) <= done
+                    and set(self.stages[name]["after"]) <= done]
+                for name in ready:
+                    pending.remove(name)
+                    running[executor.submit(
+                        self.run_stage, name, dict(manifest), force)] = name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.result():
+                        ran.append(name)
+                        manifest[name] = self.fingerprints[name]
+                        self.save_manifest(manifest)
+                    done.add(name)
+
+        return ran
+
+def add_collect_stages(
+        runner: PipelineRunner, dataset: str, dbname: str) -> None:
+    """Add the stages that fetch a dataset from the SODA API and store it."""
+    from soda_client import SodaClient
+
+    soda_client = SodaClient(dbname=dbname)
+    soda_client.set_dataset(dataset)
+    runner.add_stage(
+        f"fetch_{dataset}", soda_client.fetch_data,
+        fingerprint=soda_client.get_data_fingerprint)
+    runner.add_stage(
+        f"store_{dataset}", soda_client.store_raw_data,
+        deps=(f"fetch_{dataset}",), params={"dbname": dbname})
+    return None
+
+def get_raw_table_fingerprint(dbname: str, table_name: str) -> str:
+    """Summarize a raw table by its row count and latest crash date."""
+    df = get_sql_data(
+        dbname, RAW_TABLE_FINGERPRINT_QUERY.format(table_name=table_name))
+    row = df.iloc[0]
+    return f"{row['num_rows']}:{row['max_crash_date']}"
+
+def build_pipeline(
+        dbname: str="chi-traffic-accidents", collect: bool=True,
+        transform: bool=True, cache_dir: str=CACHE_DIR) -> PipelineRunner:
+    """Build the crashes and people pipeline."""
+    runner = PipelineRunner(cache_dir=cache_dir)
+    datasets = {
+        "crashes": (CRASHES_RAW_QUERY, CRASHES_COL_TYPES),
+        "people": (PEOPLE_RAW_QUERY, PEOPLE_COL_TYPES)}
+
+    if collect:
+        for dataset in datasets:
+            add_collect_stages(runner, dataset, dbname)
+
+    if not transform:
+        return runner
+
+    for dataset, (query, col_types) in datasets.items():
+        # The raw table is the input in both modes, so both entry points
+        # share the same fingerprint; the store stage only has to finish
+        after = (f"store_{dataset}",) if collect else ()
+        runner.add_stage(
+            f"transform_{dataset}",
+            lambda query=query, col_types=col_types, dataset=dataset: (
+                transform_and_store_data(dbname, query, col_types, dataset)),
+            fingerprint=(
+                lambda dataset=dataset: get_raw_table_fingerprint(
+                    dbname, f"{dataset}_raw")),
+            params={"dbname": dbname, "query": query, "col_types": col_types},
+            after=after)
+    runner.add_stage(
+        "join", lambda *_: join_people_to_crashes(dbname),
+        deps=("transform_crashes", "transform_people"),
+        params={"dbname": dbname})
+    return runner
+
+
+if __name__ == '__main__':
+    # Pass --no-collect to rebuild the derived tables from the raw tables
+    # already in the database
+    collect = "--no-collect" not in sys.argv
+
+    print("Starting program...\n")
+    runner = build_pipeline(collect=collect)
+    runner.run()
+    close_pools()
+
+    print("Program complete.")
@@ -0,0 +1,76 @@
+import pandas as pd
+import numpy as np
+
+from typing import Any, List, Union
+import joblib
+
+NUMERIC_COLS = ["posted_speed_limit", "num_units", "crash_hour"]
+# Model feature names that are stored under a different column name
+COLUMN_MAP = {"crash_day": "crash_day_of_week"}
+# Categorical features whose missing values model.py fills with the
+# training mode before encoding
+FILL_MODE_COLS = ["street_direction"]
+
+
+def get_category_cols(encoder: Any) -> List[str]:
+    """Return the categorical features in the order the encoder saw them."""
+    if hasattr(encoder, "feature_names_in_"):
+        return list(encoder.feature_names_in_)
+    # Older encoders do not store their input names; PredictionModel sorts
+    # the non-numeric columns before encoding
+    return sorted([
+        "alignment", "crash_day", "crash_month", "device_condition",
+        "first_crash_type", "lighting_condition", "road_defect",
+        "roadway_surface_cond", "street_direction", "traffic_control_device",
+        "trafficway_type", "weather_condition"])
+
+
+class PredictionModel:
+    """Create and implement model used for predicting results."""
+
+    def __init__(
+            self, model_path: str, scalar_path: Union[None, str]=None,
+            encoder_path: Union[None, str]=None) -> None:
+        """Initialize PredictionModel object."""
+        self.model_ = joblib.load(model_path)
+        if scalar_path:
+            self.scalar_ = joblib.load(scalar_path)
+        if encoder_path:
+            self.encoder_ = joblib.load(encoder_path)
+
+        return None
+
+    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
+        """Transform X for use in predictions."""
+        numeric_cols = NUMERIC_COLS
+        category_cols = X.columns.difference(numeric_cols)
+
+        # Transform numeric columns
+        continuous = X[numeric_cols].copy()
+        X = X.drop(columns=numeric_cols)
+        scalar = self.scalar_
+        transformed = scalar.transform(continuous)
+        transformed = pd.DataFrame(transformed, columns=numeric_cols)
+        X = pd.concat([X, transformed], axis=1)
+
+        # Transform categorical columns
+        encoder = self.encoder_
+        transformed = encoder.transform(X[category_cols])
+        matrix_cols = []
+        for col, ele in zip(category_cols, encoder.categories_):
+            for e in ele:
+                matrix_cols.append(col + "_" + e.lower())
+        X = pd.concat(
+            [X[numeric_cols].reset_index(drop=True), pd.DataFrame(
+                transformed.toarray(), columns=matrix_cols)],
+            axis=1)
+
+        return X
+
+    def predict(self, X) -> pd.DataFrame:
+        """Predict value(s)."""
+        model = self.model_
+        y_pred = model.predict(X)
+        y_pred = np.clip(y_pred, a_min=0, a_max=None)
+        y_pred = np.round(y_pred, 0)
+        return y_pred.astype(int)
@@ -6,10 +6,95 @@ from os import environ
 from sqlalchemy import create_engine
 from sqlalchemy.engine.base import Engine
 
-from typing import Union, Literal, List, Tuple, Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+from typing import Union, Literal, List, Tuple, Dict, Iterator
 
 pd.set_option("display.max_columns", None)
 
+# Defining SQL queries
+CRASHES_RAW_QUERY = """
+    SELECT *
+    FROM crashes_raw;
+    """
+PEOPLE_RAW_QUERY = """
+    SELECT *
+    FROM people_raw;
+    """
+CRASHES_QUERY = """
+    SELECT *
+    FROM crashes;
+    """
+PEOPLE_MINOR_QUERY ="""
+    SELECT crash_record_id, person_type, ejection
+    FROM people;
+    """
+
+# Defining column datatypes
+CRASHES_COL_TYPES = {
+    "datetime": ["crash_date", "date_police_notified"],
+    "integer": ["posted_speed_limit", "lane_cnt", "street_no", 
+        "beat_of_occurrence", "num_units", "injuries_total", 
+        "injuries_fatal", "injuries_incapacitating", 
+        "injuries_non_incapacitating", "injuries_reported_not_evident", 
+        "injuries_no_indication", "injuries_unknown", "crash_hour", 
+        "crash_day_of_week", "crash_month"],
+    "float": ["latitude", "longitude"],
+    "string": ["crash_record_id", "rd_no", "crash_date_est_i", 
+        "traffic_control_device", "device_condition", "weather_condition", 
+        "lighting_condition", "first_crash_type", "trafficway_type", 
+        "alignment", "roadway_surface_cond", "road_defect", "report_type", 
+        "crash_type", "intersection_related_i", "hit_and_run_i", "damage", 
+        "prim_contributory_cause", "sec_contributory_cause", 
+        "street_direction", "street_name", "photos_taken_i", 
+        "statements_taken_i", "dooring_i", "work_zone_i", "work_zone_type", 
+        "workers_present_i", "most_severe_injury"]}
+PEOPLE_COL_TYPES = {
+    "datetime": ["crash_date"],
+    "integer": ["age"],
+    "float": ["bac_result_value"],
+    "string": ["person_id", "person_type", "crash_record_id", "rd_no", 
+        "vehicle_id", "seat_no", "city", "state", "zipcode", "sex", 
+        "drivers_license_state", "drivers_license_class", 
+        "safety_equipment", "airbag_deployed", "ejection", 
+        "injury_classification", "hospital", "ems_agency", "ems_run_no", 
+        "driver_action", "driver_vision", "physical_condition", 
+        "pedpedal_location", "bac_result", "cell_phone_use"]}
+
+# Views built on a table, which would block the DROP TABLE in `to_sql`
+DEPENDENT_VIEWS_QUERY = """
+    SELECT DISTINCT dependent.relname
+    FROM pg_depend AS d
+    JOIN pg_rewrite AS r ON d.objid = r.oid
+    JOIN pg_class AS dependent ON r.ev_class = dependent.oid
+    WHERE d.refobjid = to_regclass(%s)
+        AND dependent.oid <> d.refobjid;
+    """
+
+# Indexes recreated on derived tables after each rebuild by `to_sql`
+TABLE_INDEXES = {
+    "crashes": [
+        "CREATE INDEX IF NOT EXISTS crashes_crash_record_id_idx "
+            + "ON crashes (crash_record_id);",
+        "CREATE INDEX IF NOT EXISTS crashes_crash_date_idx "
+            + "ON crashes (crash_date);"],
+    "people": [
+        "CREATE INDEX IF NOT EXISTS people_crash_record_id_idx "
+            + "ON people (crash_record_id);"],
+    "crashes_joined": [
+        "CREATE INDEX IF NOT EXISTS crashes_joined_crash_record_id_idx "
+            + "ON crashes_joined (crash_record_id);",
+        "CREATE INDEX IF NOT EXISTS crashes_joined_crash_date_idx "
+            + "ON crashes_joined (crash_date);",
+        "CREATE INDEX IF NOT EXISTS crashes_joined_stratum_idx "
+            + "ON crashes_joined (has_injuries, crash_month);"]}
+
+# Process-wide engines keyed by (dbname, port). Each engine's pool is the
+# only pool, so psycopg2 reads and pandas writes share its connections.
+_alchemy_engines: Dict[Tuple[str, int], Engine] = dict()
+_pool_lock = Lock()
+
 
 def make_postgres_conn(
         dbname: str='postgres', port: int=5432) -> pg2.extensions.connection:
@@ -23,28 +108,100 @@ def make_postgres_conn(
         password=environ['PG_PASSWORD'])
     return conn
 
+def get_pool_size() -> Tuple[int, int]:
+    """Read the minimum and maximum pool sizes from environment variables."""
+    min_size = int(environ.get('PG_POOL_MIN', 1))
+    max_size = int(environ.get('PG_POOL_MAX', 5))
+    return min_size, max_size
+
+@contextmanager
+def pooled_connection(
+        dbname: str='postgres', port: int=5432
+        ) -> Iterator[pg2.extensions.connection]:
+    """Borrow a DBAPI connection from the shared engine's pool and return it
+    when done. Blocks until a connection is free when the pool is
+    exhausted."""
+    conn = make_alchemy_engine(dbname, port).raw_connection()
+    try:
+        yield conn
+    finally:
+        # Returning the connection rolls back any open transaction
+        conn.close()
+
+def close_pools() -> None:
+    """Dispose of all shared engines and their pooled connections."""
+    with _pool_lock:
+        for engine in _alchemy_engines.values():
+            engine.dispose()
+        _alchemy_engines.clear()
+    return None
+
 def get_sql_data(
         db_name: str, query: str, 
         num_rows: Union[int, None]=None) -> pd.DataFrame:
     """Retrieve data from a PostgreSQL database."""
-    conn = make_postgres_conn(db_name)
-    
-    if not num_rows:
-        df = pd.read_sql(query, conn)
-    else:
-        df = pd.read_sql(query, conn, params=[num_rows])
-        
-    conn.close()
+    with pooled_connection(db_name) as conn:
+        if not num_rows:
+            df = pd.read_sql(query, conn)
+        else:
+            df = pd.read_sql(query, conn, params=[num_rows])
+
     return df
 
+def get_sql_data_concurrently(
+        db_name: str, queries: Dict[str, str],
+        max_workers: Union[int, None]=None) -> Dict[str, pd.DataFrame]:
+    """Run independent queries concurrently over pooled connections."""
+    if max_workers is None:
+        max_workers = min(len(queries), get_pool_size()[1])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            name: executor.submit(get_sql_data, db_name, query)
+            for name, query in queries.items()}
+        return {name: future.result() for name, future in futures.items()}
+
 def make_alchemy_engine(
         dbname: str='postgres', port: int=5432) -> Engine:
-    """Make SQL Alchemy engine to connect to PostgreSQL database."""
-    username = environ['PG_USER']
-    password = environ['PG_PASSWORD']
-    host = environ['PG_HOST']
-    string = f'postgresql://{username}:{password}@{host}:{port}/{dbname}'
-    return create_engine(string)
+    """Get the shared SQL Alchemy engine to connect to PostgreSQL database."""
+    key = (dbname, port)
+    with _pool_lock:
+        if key not in _alchemy_engines:
+            username = environ['PG_USER']
+            password = environ['PG_PASSWORD']
+            host = environ['PG_HOST']
+            min_size, max_size = get_pool_size()
+            string = (
+                f'postgresql://{username}:{password}@{host}:{port}/{dbname}')
+            _alchemy_engines[key] = create_engine(
+                string, pool_size=min_size, 
+                max_overflow=max(max_size - min_size, 0), pool_pre_ping=True)
+        return _alchemy_engines[key]
+
+def create_table_indexes(dbname: str, table_name: str) -> None:
+    """Create the managed indexes for a derived table."""
+    with pooled_connection(dbname) as conn:
+        with conn.cursor() as cursor:
+            for statement in TABLE_INDEXES.get(table_name, []):
+                cursor.execute(statement)
+            cursor.execute(f"ANALYZE {table_name};")
+        conn.commit()
+    return None
+
+def replace_table(
+        df: pd.DataFrame, dbname: str, table_name: str) -> List[str]:
+    """Replace a derived table and recreate its indexes. Views built on the
+    table block the DROP TABLE, so they are dropped and their names
+    returned for the caller to rebuild."""
+    alchemy_engine = make_alchemy_engine(dbname=dbname)
+    with alchemy_engine.begin() as conn:
+        views = conn.exec_driver_sql(
+            DEPENDENT_VIEWS_QUERY, (f"public.{table_name}",)).fetchall()
+        for view_name, in views:
+            conn.exec_driver_sql(f"DROP VIEW {view_name};")
+        df.to_sql(
+            name=table_name, con=conn, if_exists="replace", index=False)
+    create_table_indexes(dbname, table_name)
+    return [view_name for view_name, in views]
 
 def convert_df_columns(
         conversion_type: Literal["datetime", "float", "integer", "string"], 
@@ -102,12 +259,8 @@ def transform_and_store_data(dbname, query, col_types_dict, table_name):
         "zipcode", "crash_date", "rd_no"]
         df.drop(columns=drop_cols, inplace=True)
 
-    alchemy_engine = make_alchemy_engine(dbname=dbname)
     print(f"Writing {table_name} data to database...")
-    df.to_sql(
-        name=table_name, con=alchemy_engine, if_exists="replace", 
-        index=False)
-    alchemy_engine.dispose()
+    replace_table(df, dbname, table_name)
     return None
 
 def subset_aggregate_people_df(
@@ -122,73 +275,14 @@ def subset_aggregate_people_df(
     df_subset = df_subset.reset_index(drop=False)
     return df_subset
 
-
-if __name__ == '__main__':
-    print("Starting program...")
-
-    # Defining SQL queries
-    crashes_raw_query = """
-        SELECT *
-        FROM crashes_raw;
-        """
-    people_raw_query = """
-        SELECT *
-        FROM people_raw;
-        """
-    crashes_query = """
-        SELECT *
-        FROM crashes;
-        """
-    people_minor_query ="""
-        SELECT crash_record_id, person_type, ejection
-        FROM people;
-        """
-
-    # Defining column datatypes
-    crashes_col_types = {
-        "datetime": ["crash_date", "date_police_notified"],
-        "integer": ["posted_speed_limit", "lane_cnt", "street_no", 
-            "beat_of_occurrence", "num_units", "injuries_total", 
-            "injuries_fatal", "injuries_incapacitating", 
-            "injuries_non_incapacitating", "injuries_reported_not_evident", 
-            "injuries_no_indication", "injuries_unknown", "crash_hour", 
-            "crash_day_of_week", "crash_month"],
-        "float": ["latitude", "longitude"],
-        "string": ["crash_record_id", "rd_no", "crash_date_est_i", 
-            "traffic_control_device", "device_condition", "weather_condition", 
-            "lighting_condition", "first_crash_type", "trafficway_type", 
-            "alignment", "roadway_surface_cond", "road_defect", "report_type", 
-            "crash_type", "intersection_related_i", "hit_and_run_i", "damage", 
-            "prim_contributory_cause", "sec_contributory_cause", 
-            "street_direction", "street_name", "photos_taken_i", 
-            "statements_taken_i", "dooring_i", "work_zone_i", "work_zone_type", 
-            "workers_present_i", "most_severe_injury"]}
-    people_col_types = {
-        "datetime": ["crash_date"],
-        "integer": ["age"],
-        "float": ["bac_result_value"],
-        "string": ["person_id", "person_type", "crash_record_id", "rd_no", 
-            "vehicle_id", "seat_no", "city", "state", "zipcode", "sex", 
-            "drivers_license_state", "drivers_license_class", 
-            "safety_equipment", "airbag_deployed", "ejection", 
-            "injury_classification", "hospital", "ems_agency", "ems_run_no", 
-            "driver_action", "driver_vision", "physical_condition", 
-            "pedpedal_location", "bac_result", "cell_phone_use"]}
-
-    # Transforming and storing data
-    # TODO Uncomment following block for production
-    # transform_and_store_data(
-    #     dbname="chi-traffic-accidents", query=crashes_raw_query, 
-    #     col_types_dict=crashes_col_types, table_name="crashes")
-    # TODO Uncomment following block for production
-    # transform_and_store_data(dbname="chi-traffic-accidents", 
-        # query=people_raw_query, col_types_dict=people_col_types, 
-        # table_name="people")
-
-    # Joining people table columns to crashes table
+def join_people_to_crashes(dbname: str) -> None:
+    """Add people counts to the crashes table and store the joined table."""
     print("Joining people table columns to crashes table...")
-    df_people = get_sql_data("chi-traffic-accidents", people_minor_query)
-    df_crashes = get_sql_data("chi-traffic-accidents", crashes_query)
+    dfs = get_sql_data_concurrently(
+        dbname, {"people": PEOPLE_MINOR_QUERY, "crashes": CRASHES_QUERY})
+    df_people = dfs["people"]
+    df_crashes = dfs["crashes"]
+    del dfs
     df_pt = subset_aggregate_people_df(
         df_people, "person_type", ("BICYCLE", "PEDESTRIAN"), 
         {"BICYCLE": "num_bikes_involved", 
@@ -210,11 +304,14 @@ if __name__ == '__main__':
     df_temp = df_temp.drop(
         columns=["num_partially_ejected", "num_totally_ejected"])
     df_crashes = df_crashes.merge(df_temp, how="left", on="crash_record_id")
-    alchemy_engine = make_alchemy_engine(dbname="chi-traffic-accidents")
     print("Writing joined table to database...")
-    df_crashes.to_sql(
-        name="crashes_joined", con=alchemy_engine, if_exists="replace", 
-        index=False)
-    alchemy_engine.dispose()
+    dropped_views = replace_table(df_crashes, dbname, "crashes_joined")
+    if "crashes_scored" in dropped_views:
+        # Imported here because sql_scoring imports this module. The view
+        # is exported again rather than replayed so it matches the new
+        # columns.
+        from sql_scoring import refresh_scoring_view
 
-    print("Program complete.")
+        print("Rebuilding scoring view...")
+        refresh_scoring_view(dbname)
+    return None
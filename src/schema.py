@@ -0,0 +1,215 @@
+from glob import glob
+from os import path
+from datetime import date
+import json
+
+from typing import Any, Dict, Iterable, List
+
+from raw_to_transformed_data import (
+    pooled_connection, create_table_indexes, close_pools, TABLE_INDEXES)
+
+MIGRATIONS_DIR = "./sql/migrations"
+
+# Raw tables partitioned by crash_date year
+PARTITIONED_TABLES = ["crashes_raw", "people_raw"]
+
+# Queries issued by the scripts that should be served by an index or by
+# partition pruning rather than a full table scan
+PLAN_CHECKS = [
+    {"name": "sample people by crash_record_id",
+        "query": """
+            SELECT *
+            FROM people
+            WHERE crash_record_id = ANY(%(crash_record_ids)s);""",
+        "params": {"crash_record_ids": ["x"]},
+        "no_seq_scan": ["people"]},
+    {"name": "count crashes_joined strata",
+        "query": """
+            SELECT has_injuries, crash_month, COUNT(*) AS num_rows
+            FROM crashes_joined
+            GROUP BY has_injuries, crash_month;""",
+        "no_seq_scan": ["crashes_joined"]},
+    {"name": "crashes_joined month of rows",
+        "query": """
+            SELECT *
+            FROM crashes_joined
+            WHERE crash_date >= %(start)s AND crash_date < %(stop)s;""",
+        "params": {"start": "2021-01-01", "stop": "2021-02-01"},
+        "no_seq_scan": ["crashes_joined"]},
+    {"name": "raw crashes by date range",
+        "query": """
+            SELECT *
+            FROM crashes_raw
+            WHERE crash_date >= %(start)s AND crash_date < %(stop)s;""",
+        "params": {"start": "2021-01-01", "stop": "2021-02-01"},
+        "max_partitions": {"crashes_raw": 1}},
+]
+
+
+def get_migrations(migrations_dir: str=MIGRATIONS_DIR) -> List[str]:
+    """List migration files in the order they are applied."""
+    return sorted(glob(path.join(migrations_dir, "*.sql")))
+
+def get_applied_migrations(dbname: str) -> List[str]:
+    """Create the migrations table if needed and list applied versions."""
+    with pooled_connection(dbname) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version VARCHAR PRIMARY KEY,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now()
+                );""")
+            cursor.execute("SELECT version FROM schema_migrations;")
+            applied = [row[0] for row in cursor.fetchall()]
+        conn.commit()
+    return applied
+
+def migrate(dbname: str, migrations_dir: str=MIGRATIONS_DIR) -> List[str]:
+    """Apply pending migrations, each in its own transaction."""
+    applied = set(get_applied_migrations(dbname))
+    newly_applied = []
+    for migration in get_migrations(migrations_dir):
+        version = path.splitext(path.basename(migration))[0]
+        if version in applied:
+            continue
+
+        print(f"Applying migration {version}...")
+        with open(migration, "r") as f:
+            statements = f.read()
+        with pooled_connection(dbname) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(statements)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version) VALUES (%s);",
+                    (version,))
+            conn.commit()
+            for notice in conn.notices:
+                print(notice.strip())
+            del conn.notices[:]
+        newly_applied.append(version)
+    return newly_applied
+
+def table_exists(dbname: str, table_name: str) -> bool:
+    """Check whether a table exists in the public schema."""
+    with pooled_connection(dbname) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT to_regclass(%s) IS NOT NULL;",
+                (f"public.{table_name}",))
+            return cursor.fetchone()[0]
+
+def ensure_year_partitions(
+        dbname: str, table_name: str, years: Iterable[int]) -> List[int]:
+    """Create any missing yearly crash_date partitions of a raw table and
+    return the years created."""
+    default = f"{table_name}_default"
+    created = []
+    with pooled_connection(dbname) as conn:
+        with conn.cursor() as cursor:
+            for year in sorted({int(year) for year in years}):
+                partition = f"{table_name}_{year}"
+                cursor.execute(
+                    "SELECT to_regclass(%s) IS NOT NULL;",
+                    (f"public.{partition}",))
+                if cursor.fetchone()[0]:
+                    continue
+
+                print(f"Creating partition {partition}...")
+                bounds = {
+                    "start": date(year, 1, 1), "stop": date(year + 1, 1, 1)}
+                # A partition cannot be added while the default partition
+                # holds rows in its range, so move those rows into it
+                cursor.execute(
+                    f"ALTER TABLE {table_name} DETACH PARTITION {default};")
+                cursor.execute(
+                    f"CREATE TABLE {partition} PARTITION OF {table_name} "
+                    + "FOR VALUES FROM (%(start)s) TO (%(stop)s);", bounds)
+                cursor.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM {default}
+                        WHERE crash_date >= %(start)s
+                            AND crash_date < %(stop)s
+                        RETURNING *)
+                    INSERT INTO {table_name}
+                    SELECT * FROM moved;""", bounds)
+                cursor.execute(
+                    f"ALTER TABLE {table_name} "
+                    + f"ATTACH PARTITION {default} DEFAULT;")
+                created.append(year)
+        conn.commit()
+    return created
+
+def walk_plan(plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Flatten an EXPLAIN JSON plan into a list of nodes."""
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(walk_plan(child))
+    return nodes
+
+def explain_query(
+        dbname: str, query: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the JSON plan for a query with sequential scans discouraged,
+    so the plan shows whether a usable index exists."""
+    with pooled_connection(dbname) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off;")
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+def check_query_plans(
+        dbname: str, plan_checks: List[Dict]=PLAN_CHECKS) -> List[str]:
+    """Check the plans of the scripts' queries and return any problems."""
+    problems = []
+    for check in plan_checks:
+        nodes = walk_plan(
+            explain_query(dbname, check["query"], check.get("params", {})))
+
+        for table in check.get("no_seq_scan", []):
+            seq_scans = [
+                node for node in nodes if node["Node Type"] == "Seq Scan"
+                and node.get("Relation Name", "").startswith(table)]
+            if seq_scans:
+                problems.append(
+                    f"{check['name']}: sequential scan on {table}")
+
+        for table, max_partitions in check.get("max_partitions", {}).items():
+            scanned = {
+                node["Relation Name"] for node in nodes
+                if node.get("Relation Name", "").startswith(table + "_")}
+            if len(scanned) > max_partitions:
+                problems.append(
+                    f"{check['name']}: scanned {len(scanned)} {table} "
+                    + f"partitions, expected at most {max_partitions}")
+    return problems
+
+
+if __name__ == '__main__':
+    print("Starting program...")
+    dbname = "chi-traffic-accidents"
+
+    print("Applying migrations...")
+    migrate(dbname)
+
+    print("Creating partitions through next year...")
+    this_year = date.today().year
+    for table_name in PARTITIONED_TABLES:
+        ensure_year_partitions(
+            dbname, table_name, range(this_year, this_year + 2))
+
+    print("Creating indexes on derived tables...")
+    for table_name in TABLE_INDEXES:
+        if table_exists(dbname, table_name):
+            create_table_indexes(dbname, table_name)
+
+    print("Checking query plans...")
+    problems = check_query_plans(dbname)
+    for problem in problems:
+        print(f"Plan check failed: {problem}")
+    if not problems:
+        print("All plan checks passed.")
+    close_pools()
+
+    print("Program complete.")
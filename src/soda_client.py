@@ -1,14 +1,23 @@
 import pandas as pd
 from sodapy import Socrata
 from os import environ
-import psycopg2 as pg2
-from sqlalchemy import create_engine
-from sqlalchemy.engine.base import Engine
+from sqlalchemy import inspect
 
 from typing import Literal
 
+from raw_to_transformed_data import make_alchemy_engine, close_pools
+from schema import ensure_year_partitions
+
 pd.set_option("display.max_columns", None)
 
+# Record crashes seen for the first time, for the drift monitor
+LOG_INGEST_QUERY = """
+    INSERT INTO crash_ingest_log (crash_record_id)
+    SELECT crash_record_id
+    FROM crashes_raw
+    ON CONFLICT DO NOTHING;
+    """
+
 class SodaClient:
     """
     Client for downloading and storing traffic crashes and traffic crashes 
@@ -26,13 +35,10 @@ class SodaClient:
         self.dbname = dbname
         self.port = port
 
-        self.username = environ['PG_USER']
-        self.password = environ['PG_PASSWORD']
-        self.host = environ['PG_HOST']
-
         self.dataset = None
         self.dataset_code = None
         self.sql_table = None
+        self.key_cols = None
 
         return None
     
@@ -52,50 +58,101 @@ class SodaClient:
 
     def store_raw_data(self, df: pd.DataFrame) -> None:
         """Connect to PostgreSQL database and store raw data."""
+        # Rows with missing or repeated keys would abort the whole load
+        df = df.copy()
+        df["crash_date"] = pd.to_datetime(df["crash_date"], errors="coerce")
+        num_rows = len(df)
+        df = df.dropna(subset=self.key_cols)
+        df = df.drop_duplicates(subset=self.key_cols, keep="last")
+        if len(df) < num_rows:
+            print(
+                f"Dropped {num_rows - len(df)} rows with missing or "
+                + "duplicate keys")
+
         print("Connecting to database...")
-        engine_string = (
-            f"postgresql://{self.username}:{self.password}@{self.host}"
-            + f":{self.port}/{self.dbname}")
-        alchemy_engine = create_engine(engine_string)
-
-        print("Writing to database...")
-        df.to_sql(
-            self.sql_table, alchemy_engine, index=False, if_exists="replace")
-        
-        print("Closing database connection...")
-        alchemy_engine.dispose()
+        ensure_year_partitions(
+            self.dbname, self.sql_table, df["crash_date"].dt.year.unique())
+        alchemy_engine = make_alchemy_engine(self.dbname, self.port)
+
+        # Truncate and append rather than replace so the table keeps its
+        # keys, indexes and partitions
+        with alchemy_engine.begin() as conn:
+            table_cols = [
+                col["name"] 
+                for col in inspect(conn).get_columns(self.sql_table)]
+            missing_cols = pd.Index(table_cols).difference(df.columns)
+            if len(missing_cols) > 0:
+                raise ValueError(
+                    f"The {self.dataset} dataset no longer has columns "
+                    + f"{missing_cols.to_list()}.")
+            # Keep new columns as the raw VARCHAR columns are kept
+            for col in df.columns.difference(table_cols):
+                print(f"Adding new column {col} to {self.sql_table}...")
+                conn.exec_driver_sql(
+                    f'ALTER TABLE {self.sql_table} '
+                    + f'ADD COLUMN "{col}" VARCHAR;')
+
+            print("Writing to database...")
+            conn.exec_driver_sql(f"TRUNCATE TABLE {self.sql_table};")
+            df.to_sql(
+                self.sql_table, conn, index=False, if_exists="append")
+            if self.dataset == "crashes":
+                result = conn.exec_driver_sql(LOG_INGEST_QUERY)
+                print(f"Logged {result.rowcount} new crashes")
 
         return None
-    
-    def collect_data(
+
+    def set_dataset(
             self, dataset: Literal["crashes", "people"]="crashes") -> None:
-        """Fetch data from the SODA API and save raw data to PostgreSQL 
-        database"""
+        """Set the SODA dataset code and SQL table for a dataset."""
         self.dataset = dataset
         if self.dataset == "crashes":
             self.dataset_code = "85ca-t3if"
             self.sql_table = "crashes_raw"
+            self.key_cols = ["crash_record_id", "crash_date"]
         elif self.dataset == "people":
             self.dataset_code = "u6pd-qa9d"
             self.sql_table = "people_raw"
+            self.key_cols = ["person_id", "crash_date"]
         else:
             self.dataset_code = None
             raise ValueError("`dataset` must be set to 'crashes' or 'people'.")
-        
+
+        return None
+
+    def get_data_fingerprint(self) -> str:
+        """Fetch the time the dataset's rows were last updated from the 
+        SODA API metadata."""
+        soda_client = Socrata("data.cityofchicago.org", self.app_token)
+        metadata = soda_client.get_metadata(self.dataset_code)
+        soda_client.close()
+        return str(metadata.get("rowsUpdatedAt"))
+
+    def fetch_data(self) -> pd.DataFrame:
+        """Fetch the raw data for the current dataset."""
         print(f"Collecting the {self.dataset} dataset...")
         df_data = self.get_raw_data()
         if self.dataset == "crashes":
             df_data = df_data.drop(columns=["location"])
+        return df_data
 
+    def collect_data(
+            self, dataset: Literal["crashes", "people"]="crashes") -> None:
+        """Fetch data from the SODA API and save raw data to PostgreSQL 
+        database"""
+        self.set_dataset(dataset)
+        df_data = self.fetch_data()
         self.store_raw_data(df_data)
         print(f"Completed collecting the {self.dataset} dataset...\n")
 
 
 if __name__ == '__main__':
+    from pipeline import build_pipeline
+
     print("Starting program...\n")
-    datasets = ["crashes", "people"]
-    for dataset in datasets:
-        soda_client = SodaClient()
-        soda_client.collect_data(dataset)
+    # Fetch and store both datasets concurrently
+    runner = build_pipeline(transform=False)
+    runner.run()
+    close_pools()
 
     print("Program ended.")
@@ -0,0 +1,191 @@
+import pandas as pd
+import numpy as np
+
+from typing import Dict, List, Tuple
+
+from prediction_model import (
+    PredictionModel, NUMERIC_COLS, COLUMN_MAP, FILL_MODE_COLS,
+    get_category_cols)
+from raw_to_transformed_data import get_sql_data, pooled_connection
+
+MODEL_PATH = "./models/lasso-reg-model.pkl"
+SCALAR_PATH = "./models/scaler.pkl"
+ENCODER_PATH = "./models/encoder.pkl"
+
+# Most common value of a column, breaking ties like pandas' mode()
+MODE_QUERY = """
+    SELECT {col} AS mode
+    FROM {table_name}
+    WHERE {col} IS NOT NULL
+    GROUP BY {col}
+    ORDER BY COUNT(*) DESC, {col}
+    LIMIT 1;
+    """
+
+
+def get_linear_weights(
+        prediction_model: PredictionModel
+        ) -> Tuple[float, Dict[str, float], Dict[str, Dict[str, float]]]:
+    """Fold the scaler into the linear model and return the intercept,
+    the weights of the raw numeric columns and the weight of each category
+    value."""
+    model = prediction_model.model_
+    scaler = prediction_model.scalar_
+    encoder = prediction_model.encoder_
+    coefs = np.ravel(model.coef_)
+    intercept = float(np.ravel(model.intercept_)[0])
+
+    # MinMaxScaler computes x * scale_ + min_
+    numeric_weights = dict()
+    for i, col in enumerate(NUMERIC_COLS):
+        numeric_weights[col] = float(coefs[i] * scaler.scale_[i])
+        intercept += float(coefs[i] * scaler.min_[i])
+
+    category_weights = dict()
+    i = len(NUMERIC_COLS)
+    for col, categories in zip(
+            get_category_cols(encoder), encoder.categories_):
+        category_weights[col] = dict()
+        for category in categories:
+            if coefs[i] != 0:
+                category_weights[col][str(category)] = float(coefs[i])
+            i += 1
+
+    return intercept, numeric_weights, category_weights
+
+def get_fill_values(
+        dbname: str, table_name: str="crashes_joined",
+        fill_cols: List[str]=FILL_MODE_COLS,
+        column_map: Dict[str, str]=COLUMN_MAP) -> Dict[str, str]:
+    """Look up the modes model.py fills missing values with."""
+    fill_values = dict()
+    for col in fill_cols:
+        query = MODE_QUERY.format(
+            col=column_map.get(col, col), table_name=table_name)
+        fill_values[col] = str(get_sql_data(dbname, query)["mode"].iloc[0])
+    return fill_values
+
+def quote_literal(value: str) -> str:
+    """Quote a string as a SQL literal."""
+    return "'" + value.replace("'", "''") + "'"
+
+def export_scoring_expression(
+        prediction_model: PredictionModel, fill_values: Dict[str, str],
+        column_map: Dict[str, str]=COLUMN_MAP) -> str:
+    """Write the model's rounded, non-negative prediction as a SQL
+    expression over the table's columns. Missing values in `fill_values`
+    columns score as the fill value, and other category values the encoder
+    has not seen contribute nothing to the score."""
+    intercept, numeric_weights, category_weights = get_linear_weights(
+        prediction_model)
+
+    # Work in double precision so ROUND rounds halves to even like np.round
+    # rather than away from zero as it does for NUMERIC
+    terms = [f"{intercept!r}::float8"]
+    for col, weight in numeric_weights.items():
+        col = column_map.get(col, col)
+        terms.append(f"{weight!r}::float8 * {col}::float8")
+    for col, weights in category_weights.items():
+        if not weights:
+            continue
+        value = f"{column_map.get(col, col)}::VARCHAR"
+        if col in fill_values:
+            value = f"COALESCE({value}, {quote_literal(fill_values[col])})"
+        cases = "\n".join(
+            f"            WHEN {quote_literal(category)} "
+            + f"THEN {weight!r}::float8"
+            for category, weight in weights.items())
+        terms.append(
+            f"CASE {value}\n{cases}\n            ELSE 0::float8 END")
+
+    expression = "\n        + ".join(terms)
+    return f"GREATEST(ROUND(\n        {expression}), 0)::INTEGER"
+
+def export_scoring_view(
+        prediction_model: PredictionModel, fill_values: Dict[str, str],
+        view_name: str="crashes_scored",
+        table_name: str="crashes_joined") -> str:
+    """Write a SQL view that scores every row of a table."""
+    expression = export_scoring_expression(prediction_model, fill_values)
+    return f"""CREATE OR REPLACE VIEW {view_name} AS
+SELECT
+    *,
+    {expression} AS predicted_injuries
+FROM {table_name};
+"""
+
+def create_scoring_view(dbname: str, sql: str) -> None:
+    """Create the scoring view in the database."""
+    with pooled_connection(dbname) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+        conn.commit()
+    return None
+
+def refresh_scoring_view(
+        dbname: str, model_path: str=MODEL_PATH,
+        scalar_path: str=SCALAR_PATH,
+        encoder_path: str=ENCODER_PATH) -> PredictionModel:
+    """Export the saved model as the scoring view against the current
+    columns of the table and create it."""
+    prediction_model = PredictionModel(model_path, scalar_path, encoder_path)
+    fill_values = get_fill_values(dbname)
+    sql = export_scoring_view(prediction_model, fill_values)
+    with open("./sql/crashes-scored-view.sql", "w") as f:
+        f.write(sql)
+    create_scoring_view(dbname, sql)
+    return prediction_model
+
+def check_scoring_parity(
+        dbname: str, prediction_model: PredictionModel,
+        fill_values: Dict[str, str], view_name: str="crashes_scored",
+        num_rows: int=10_000,
+        column_map: Dict[str, str]=COLUMN_MAP) -> pd.DataFrame:
+    """Compare the view's predictions with `PredictionModel.predict` and
+    return the rows that disagree."""
+    query = f"""
+        SELECT *
+        FROM {view_name}
+        LIMIT %s;"""
+    df = get_sql_data(dbname, query, num_rows)
+
+    category_cols = get_category_cols(prediction_model.encoder_)
+    feature_cols = NUMERIC_COLS + category_cols
+    X = df.rename(
+        columns={value: key for key, value in column_map.items()})
+    X = X[feature_cols].fillna(fill_values)
+
+    # The encoder raises on unseen values, so only compare known rows
+    known = pd.Series(True, index=X.index)
+    for col, categories in zip(
+            category_cols, prediction_model.encoder_.categories_):
+        known &= X[col].isin(categories)
+    if (~known).sum() > 0:
+        print(f"Excluded {(~known).sum()} rows with unseen or missing values.")
+    X = X.loc[known].reset_index(drop=True)
+    df = df.loc[known].reset_index(drop=True)
+
+    X_transformed = prediction_model.transform(X)
+    df["python_prediction"] = prediction_model.predict(X_transformed)
+    mismatches = df.loc[
+        df["python_prediction"] != df["predicted_injuries"],
+        ["crash_record_id", "predicted_injuries", "python_prediction"]]
+
+    print(f"Compared {len(df)} rows, {len(mismatches)} mismatches.")
+    return mismatches
+
+
+if __name__ == '__main__':
+    print("Starting program...")
+    dbname = "chi-traffic-accidents"
+
+    print("Exporting scoring view...")
+    prediction_model = refresh_scoring_view(dbname)
+
+    print("Checking parity with PredictionModel...")
+    mismatches = check_scoring_parity(
+        dbname, prediction_model, get_fill_values(dbname))
+    if len(mismatches) > 0:
+        print(mismatches.head())
+
+    print("Program complete.")
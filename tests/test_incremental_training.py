@@ -0,0 +1,84 @@
+import sys
+from os import path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+for module in ("joblib", "psycopg2", "sqlalchemy"):
+    pytest.importorskip(module)
+
+from sklearn.linear_model import LinearRegression, Ridge, Lasso
+from sklearn.preprocessing import MinMaxScaler, OneHotEncoder
+
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, path.join(ROOT_DIR, "src"))
+
+from prediction_model import NUMERIC_COLS
+from incremental_training import (
+    compute_sufficient_stats, combine_stats, fit_from_stats)
+
+CATEGORY_COLS = ["street_direction", "weather_condition"]
+
+
+def make_crashes(num_rows: int=500, seed: int=0) -> pd.DataFrame:
+    """Build a small synthetic crashes frame with missing directions."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "posted_speed_limit": rng.choice([15, 25, 30, 35, 45], num_rows),
+        "num_units": rng.integers(1, 5, num_rows),
+        "crash_hour": rng.integers(0, 24, num_rows),
+        "street_direction": rng.choice(["N", "S", "E", "W"], num_rows),
+        "weather_condition": rng.choice(["CLEAR", "RAIN", "SNOW"], num_rows)})
+    df.loc[rng.random(num_rows) < 0.1, "street_direction"] = np.nan
+    df["injuries_total"] = (
+        0.02 * df["posted_speed_limit"] + 0.3 * df["num_units"]
+        + (df["weather_condition"] == "SNOW")
+        + (df["street_direction"] == "W")
+        + rng.normal(0, 0.5, num_rows))
+    return df
+
+def prepare_like_model_py(df: pd.DataFrame):
+    """Fill, scale and encode the features as model.py does."""
+    X = df[NUMERIC_COLS + CATEGORY_COLS].copy()
+    X["street_direction"] = (
+        X["street_direction"].fillna(X["street_direction"].mode()[0]))
+    scaler = MinMaxScaler()
+    scaled = scaler.fit_transform(X[NUMERIC_COLS])
+    encoder = OneHotEncoder()
+    onehot = encoder.fit_transform(X[CATEGORY_COLS]).toarray()
+    return np.hstack([scaled, onehot]), scaler, encoder
+
+
+@pytest.mark.parametrize("model_type, sklearn_model, alpha", [
+    ("linear", LinearRegression(), 1.0),
+    ("ridge", Ridge(alpha=2.0), 2.0),
+    ("lasso", Lasso(alpha=0.01, tol=1e-12, max_iter=100_000), 0.01)])
+def test_fit_from_stats_matches_scikit_learn(
+        model_type, sklearn_model, alpha):
+    """Refitting from monthly statistics matches a full retrain."""
+    df = make_crashes()
+    X, scaler, encoder = prepare_like_model_py(df)
+    sklearn_model.fit(X, df["injuries_total"])
+
+    # Split the rows as if they came from two months
+    stats = combine_stats([
+        compute_sufficient_stats(df.iloc[:200], encoder),
+        compute_sufficient_stats(df.iloc[200:], encoder)])
+    model, stats_scaler = fit_from_stats(stats, encoder, model_type, alpha)
+
+    np.testing.assert_allclose(
+        stats_scaler.data_min_, scaler.data_min_, atol=1e-12)
+    np.testing.assert_allclose(
+        stats_scaler.data_max_, scaler.data_max_, atol=1e-12)
+    np.testing.assert_allclose(model.coef_, sklearn_model.coef_, atol=1e-5)
+    assert model.intercept_ == pytest.approx(
+        sklearn_model.intercept_, abs=1e-5)
+
+def test_compute_sufficient_stats_skips_empty_batches():
+    """A month with no usable rows has no statistics."""
+    df = make_crashes(num_rows=10)
+    _, _, encoder = prepare_like_model_py(df)
+    df["num_units"] = np.nan
+    assert compute_sufficient_stats(df, encoder) is None
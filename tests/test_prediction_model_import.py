@@ -0,0 +1,33 @@
+import subprocess
+import sys
+from os import path
+
+import pytest
+
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+IMPORT_BUDGET_SECONDS = 2.0
+
+# Modules the serving path must not pull in when PredictionModel is imported
+HEAVY_MODULES = (
+    "matplotlib", "sklearn.ensemble", "sklearn.model_selection", "psycopg2",
+    "sqlalchemy", "raw_to_transformed_data", "src.raw_to_transformed_data")
+
+
+def test_prediction_model_import_is_lightweight():
+    """Import PredictionModel in a fresh interpreter as the web app does."""
+    for module in ("pandas", "numpy", "joblib"):
+        pytest.importorskip(module)
+
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "from src.prediction_model import PredictionModel\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(m for m in sys.argv[1:] if m in sys.modules))\n")
+    result = subprocess.run(
+        [sys.executable, "-c", code, *HEAVY_MODULES], capture_output=True,
+        text=True, check=True, cwd=ROOT_DIR)
+    elapsed, loaded = result.stdout.split("\n")[:2]
+
+    assert loaded == ""
+    assert float(elapsed) < IMPORT_BUDGET_SECONDS